@@ -1,4 +1,4 @@
-from src import app
+from src.app import app
 
 
 if __name__ == '__main__':
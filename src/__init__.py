@@ -1 +0,0 @@
-from src.app import app, create_app
@@ -5,15 +5,18 @@ from flask import Flask
 from flask_cors import CORS
 from flask_smorest import Api
 
-from src.config import Db_config, db, ma
+from src.commands import equipment_cli
+from src.config import Db_config, db, ma, replica_router
 import src.models
 from src.helpers import EnvVarsTranslater
 from src.routers import (
     equipment_blueprint,
     login_blueprint,
+    metrics_blueprint,
     register_blueprint,
     validate_token_blueprint
 )
+from src.routers.helpers import admission_controller, request_profiler
 
 
 basedir = os.path.dirname(os.path.realpath(__file__))
@@ -38,6 +41,8 @@ def create_app(config_name: str = 'default') -> Flask:
         'SQLALCHEMY_TRACK_MODIFICATIONS')
     app.config['SQLALCHEMY_ECHO'] = EnvVarsTranslater.get_bool(
         'SQLALCHEMY_SHOW_QUERY_LOGS')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_timeout': EnvVarsTranslater.get_int('DB_POOL_TIMEOUT', default=5)}
 
     if config_name == 'testing':
         app.config['SQLALCHEMY_DATABASE_URI'] = Db_config.get_db_con_uri()
@@ -48,6 +53,9 @@ def create_app(config_name: str = 'default') -> Flask:
 
     db.init_app(app)
     ma.init_app(app)
+    replica_router.init_app(app, Db_config.get_db_replica_uris())
+    admission_controller.init_app(app)
+    request_profiler.init_app(app)
 
     api = Api(app)
 
@@ -60,9 +68,12 @@ def create_app(config_name: str = 'default') -> Flask:
 
     api.register_blueprint(equipment_blueprint)
     api.register_blueprint(login_blueprint)
+    api.register_blueprint(metrics_blueprint)
     api.register_blueprint(register_blueprint)
     api.register_blueprint(validate_token_blueprint)
 
+    app.cli.add_command(equipment_cli)
+
     return app
 
 
@@ -0,0 +1 @@
+from src.commands.equipment import equipment_cli
@@ -0,0 +1,57 @@
+from contextlib import closing
+
+import click
+from flask.cli import AppGroup
+
+from src.logs import logger
+from src.routers.helpers import backfill_devices, compact_readings, configure_session, migrate_storage, rebuild_summary
+
+equipment_cli = AppGroup('equipment', help='Equipment maintenance tasks.')
+
+
+@equipment_cli.command('compact')
+@click.option('--equipment-id', default=None,
+              help='Only compact the readings of this equipment.')
+@click.option('--batch-size', type=int, default=None,
+              help='Raw rows moved per transaction (RETENTION_BATCH_SIZE by default).')
+def compact(equipment_id: str | None, batch_size: int | None):
+    """Moves raw readings past their retention window into rollups."""
+    compacted_rows = compact_readings(equipment_id, batch_size)
+    logger.info(f'{compacted_rows} raw readings compacted')
+    click.echo(f'{compacted_rows} raw readings compacted')
+
+
+@equipment_cli.command('sync-devices')
+def sync_devices():
+    """Fills the equipment id search table from the stored readings."""
+    with closing(configure_session()) as session:
+        devices = backfill_devices(session)
+        session.commit()
+
+    logger.info(f'{devices} equipment ids synced')
+    click.echo(f'{devices} equipment ids synced')
+
+
+@equipment_cli.command('rebuild-summary')
+def rebuild_summary_command():
+    """Recomputes the latest reading and count of every equipment."""
+    with closing(configure_session()) as session:
+        summaries = rebuild_summary(session)
+        session.commit()
+
+    logger.info(f'{summaries} equipment summaries rebuilt')
+    click.echo(f'{summaries} equipment summaries rebuilt')
+
+
+@equipment_cli.command('migrate-storage')
+def migrate_storage_command():
+    """Converts the tables of a database created by an older version."""
+    with closing(configure_session()) as session:
+        steps = migrate_storage(session)
+        session.commit()
+
+    if steps:
+        logger.info(f"Storage migrated: {', '.join(steps)}")
+        click.echo(f"Storage migrated: {', '.join(steps)}. Run rebuild-summary to fill the summary.")
+    else:
+        click.echo('Storage is up to date')
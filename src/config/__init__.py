@@ -1 +1,2 @@
 from src.config.db_config import Db_config, db, ma
+from src.config.db_router import ReplicaRouter, RoutingSession, replica_router
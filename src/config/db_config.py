@@ -10,11 +10,12 @@ from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.pool import NullPool
 
+from src.config.db_router import RoutingSession
 from src.logs import logger
 
 load_dotenv()
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 ma = Marshmallow()
 
 
@@ -34,6 +35,12 @@ class Db_config(ABC):
             logger.exception(msg)
             return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
 
+    @staticmethod
+    def get_db_replica_uris() -> list[str]:
+        return [uri.strip()
+                for uri in os.getenv('DATABASE_REPLICA_URIS', '').split(',')
+                if uri.strip()]
+
     @staticmethod
     def create_default_db_engine(database_uri: str | None = None):
         try:
@@ -45,6 +52,22 @@ class Db_config(ABC):
             logger.exception(msg)
             return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
 
+    @staticmethod
+    def create_pooled_db_engine(pool_size: int, database_uri: str | None = None, pool_timeout: int = 30):
+        try:
+            if not database_uri:
+                database_uri = Db_config.get_db_con_uri()
+            return create_engine(database_uri,
+                                 client_encoding='utf8',
+                                 pool_size=pool_size,
+                                 max_overflow=0,
+                                 pool_timeout=pool_timeout,
+                                 pool_pre_ping=True)
+        except SQLAlchemyError as ex:
+            msg = f'Error creating pooled database engine:  {str(ex)}'
+            logger.exception(msg)
+            return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
+
 
 def get_response(status_code: int, content: str | dict | list = None) -> Response:
     if isinstance(content, str):
@@ -0,0 +1,156 @@
+from itertools import cycle
+from threading import Lock
+from time import monotonic, time
+
+from flask import Flask, Response, g, has_app_context, request
+from flask_sqlalchemy.session import Session as BaseSession
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+
+from src.helpers import EnvVarsTranslater
+from src.logs import logger
+
+PRIMARY_COOKIE = 'db_primary_until'
+
+# seconds since the last replayed transaction, unless the replica replayed
+# everything it received: an idle primary is not lag
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class ReplicaRouter():
+    """
+    Sends read-only requests to healthy read replicas.
+
+    A replica is checked at most once every `health_ttl` seconds; when it is
+    down, or lags behind the primary by more than `max_lag` seconds, reads
+    fall back to the primary until the next check. A client that has just
+    written reads from the primary for `sticky_seconds`, tracked both per
+    user in this worker and through a cookie, so it sees its own writes
+    whichever worker serves the next request.
+    """
+
+    def __init__(self):
+        self.engines: list[Engine] = []
+        self.health_ttl = 10
+        self.max_lag = 30
+        self.sticky_seconds = 5
+        self.connect_timeout = 2
+        self._engines_cycle = None
+        self._health: dict[Engine, tuple[bool, float]] = {}
+        self._last_write_by_user: dict = {}
+        self._next_prune = 0.0
+        self._lock = Lock()
+
+    def init_app(self, app: Flask, replica_uris: list[str]):
+        self.connect_timeout = EnvVarsTranslater.get_int(
+            'DATABASE_REPLICA_CONNECT_TIMEOUT', default=2)
+        self.engines = [self.create_replica_engine(uri) for uri in replica_uris]
+        self._engines_cycle = cycle(self.engines) if self.engines else None
+        self._health = {}
+        self.health_ttl = EnvVarsTranslater.get_int(
+            'DATABASE_REPLICA_HEALTH_TTL', default=10)
+        self.max_lag = EnvVarsTranslater.get_int(
+            'DATABASE_REPLICA_MAX_LAG_SECONDS', default=30)
+        self.sticky_seconds = EnvVarsTranslater.get_int(
+            'DATABASE_REPLICA_STICKY_SECONDS', default=5)
+
+        app.after_request(self.set_primary_cookie)
+
+    def create_replica_engine(self, uri: str) -> Engine:
+        # health checks run inside requests, so a dead replica must fail fast
+        connect_args = {'connect_timeout': self.connect_timeout} \
+            if make_url(uri).get_backend_name() == 'postgresql' else {}
+        return create_engine(uri, pool_pre_ping=True, connect_args=connect_args)
+
+    def is_healthy(self, engine: Engine) -> bool:
+        healthy, checked_at = self._health.get(engine, (False, 0))
+        if monotonic() - checked_at < self.health_ttl:
+            return healthy
+
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == 'postgresql':
+                    lag = connection.execute(text(REPLICA_LAG_SQL)).scalar()
+                    healthy = lag <= self.max_lag
+                else:
+                    connection.execute(text('SELECT 1'))
+                    healthy = True
+        except Exception as ex:
+            logger.warning(f'Read replica {engine.url.render_as_string()} is unavailable: {ex}')
+            healthy = False
+
+        self._health[engine] = (healthy, monotonic())
+        return healthy
+
+    def get_read_engine(self, user_id=None) -> Engine | None:
+        if not self._engines_cycle or self.is_sticky(user_id):
+            return None
+
+        with self._lock:
+            candidates = [next(self._engines_cycle) for _ in self.engines]
+
+        for engine in candidates:
+            if self.is_healthy(engine):
+                return engine
+
+        return None
+
+    def is_sticky(self, user_id=None) -> bool:
+        now = time()
+
+        if user_id is not None and self._last_write_by_user.get(user_id, 0) > now:
+            return True
+
+        try:
+            return float(request.cookies.get(PRIMARY_COOKIE, 0)) > now
+        except (RuntimeError, ValueError):
+            return False
+
+    def mark_write(self, user_id=None):
+        now = time()
+        primary_until = now + self.sticky_seconds
+
+        if user_id is not None:
+            with self._lock:
+                self._last_write_by_user[user_id] = primary_until
+                if now >= self._next_prune:
+                    self.prune_writes(now)
+
+        if has_app_context():
+            g.primary_until = primary_until
+
+    def prune_writes(self, now: float):
+        """Forgets the users whose sticky window is over, at most once per window."""
+        self._last_write_by_user = {user_id: primary_until
+                                    for user_id, primary_until in self._last_write_by_user.items()
+                                    if primary_until > now}
+        self._next_prune = now + self.sticky_seconds
+
+    def set_primary_cookie(self, response: Response) -> Response:
+        primary_until = g.get('primary_until')
+        if primary_until and self.engines:
+            response.set_cookie(PRIMARY_COOKIE, f'{primary_until:.3f}',
+                                max_age=self.sticky_seconds, httponly=True)
+        return response
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(BaseSession):
+    """Uses the read engine chosen for the current request, if any, except while flushing."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context():
+            read_engine = g.get('read_engine')
+            if read_engine is not None:
+                return read_engine
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
@@ -2,3 +2,4 @@ from src.helpers.context_helper import ContextHelper
 from src.helpers.current_time import CurrentTime
 from src.helpers.env_vars_translater import EnvVarsTranslater
 from src.helpers.log_helper import LogHelper
+from src.helpers.metrics import Metrics, metrics
@@ -9,6 +9,10 @@ class CurrentTime():
         format = "%Y-%m-%d %H:%M:%S.%f"
         return datetime.now(timezone(tmz)).strftime(format)
 
+    @staticmethod
+    def current_datetime(tmz: str = 'Etc/GMT+0') -> datetime:
+        return datetime.now(timezone(tmz)).replace(tzinfo=None)
+
     @staticmethod
     def current_time_concatenated(tmz: str = 'Etc/GMT+0') -> str:
         format = "%d-%m-%Y-%H-%M-%S"
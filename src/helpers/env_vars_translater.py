@@ -4,9 +4,12 @@ from abc import ABC
 
 class EnvVarsTranslater(ABC):
     @staticmethod
-    def get_bool(env_var_name: str) -> bool:
+    def get_bool(env_var_name: str, default: bool | None = None) -> bool:
         valid_values: list[str] = ["true", "false"]
 
+        if os.getenv(env_var_name) is None and default is not None:
+            return default
+
         env_value: str = os.getenv(env_var_name).lower().strip()
 
         if env_value not in valid_values:
@@ -18,7 +21,10 @@ class EnvVarsTranslater(ABC):
         return env_value == "true"
 
     @staticmethod
-    def get_int(env_var_name: str) -> int:
+    def get_int(env_var_name: str, default: int | None = None) -> int:
+        if os.getenv(env_var_name) is None and default is not None:
+            return default
+
         env_value: str = os.getenv(env_var_name).lower().strip()
 
         try:
@@ -28,3 +34,18 @@ class EnvVarsTranslater(ABC):
                 f"It was not possible convert the env variable '{
                     env_var_name}' with the value '{env_value}' to "
                 f"'int'. The value needs to be an integer")
+
+    @staticmethod
+    def get_float(env_var_name: str, default: float | None = None) -> float:
+        if os.getenv(env_var_name) is None and default is not None:
+            return default
+
+        env_value: str = os.getenv(env_var_name).lower().strip()
+
+        try:
+            return float(env_value)
+        except Exception:
+            raise Exception(
+                f"It was not possible convert the env variable '{
+                    env_var_name}' with the value '{env_value}' to "
+                f"'float'. The value needs to be a number")
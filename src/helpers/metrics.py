@@ -0,0 +1,89 @@
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic, perf_counter
+
+
+class Metrics():
+    """
+    Process wide counters and latency samples.
+
+    Counters keep their total plus one bucket per second for the last
+    `window` seconds, so rates reflect the current load rather than the
+    average since start-up. Latencies keep the last `max_samples`
+    observations per name. Every uWSGI worker has its own registry.
+    """
+
+    def __init__(self, window: int = 60, max_samples: int = 4096):
+        self.window = window
+        self.max_samples = max_samples
+        self.reset()
+
+    def reset(self):
+        self._lock = Lock()
+        self._started_at = monotonic()
+        self._totals: dict[str, float] = defaultdict(float)
+        self._seconds: dict[str, deque] = defaultdict(
+            lambda: deque(maxlen=self.window))
+        self._samples: dict[str, deque] = defaultdict(
+            lambda: deque(maxlen=self.max_samples))
+
+    def increment(self, name: str, amount: float = 1):
+        second = int(monotonic())
+
+        with self._lock:
+            self._totals[name] += amount
+
+            buckets = self._seconds[name]
+            if buckets and buckets[-1][0] == second:
+                buckets[-1][1] += amount
+            else:
+                buckets.append([second, amount])
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start)
+
+    def get_rate(self, name: str) -> float:
+        now = monotonic()
+        elapsed = min(now - self._started_at, self.window) or 1
+
+        with self._lock:
+            recent = sum(amount for second, amount in self._seconds.get(name, ())
+                         if second > now - self.window)
+
+        return recent / elapsed
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            totals = dict(self._totals)
+            samples = {name: sorted(values)
+                       for name, values in self._samples.items() if values}
+
+        return {
+            'uptime_seconds': round(monotonic() - self._started_at, 1),
+            'counters': {name: {'total': total,
+                                'per_second': round(self.get_rate(name), 2)}
+                         for name, total in sorted(totals.items())},
+            'latencies_ms': {name: {'count': len(values),
+                                    'p50': round(get_percentile(values, 50) * 1000, 2),
+                                    'p99': round(get_percentile(values, 99) * 1000, 2),
+                                    'max': round(values[-1] * 1000, 2)}
+                             for name, values in sorted(samples.items())},
+        }
+
+
+def get_percentile(sorted_values: list[float], percentile: float) -> float:
+    index = round(percentile / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+metrics = Metrics()
@@ -1,2 +1,15 @@
-from src.models.equipment import Equipment, EquipmentSchema
+from src.models.equipment import (
+    CURRENT_TRANSACTION_ID,
+    Equipment,
+    EquipmentReading,
+    EquipmentRowEncoder,
+    EquipmentSchema,
+    equipment_change_seq,
+    get_row_encoder
+)
+from src.models.equipment_device import EquipmentDevice
+from src.models.equipment_rollup import EquipmentRollup
+from src.models.equipment_summary import EquipmentSummary, EquipmentSummarySchema
+from src.models.query_result import QueryResult
+from src.models.upload_ledger import UploadChunk, UploadLedger, UploadLedgerSchema
 from src.models.user import User, UserSchema
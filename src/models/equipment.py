@@ -1,22 +1,65 @@
 from datetime import datetime
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+from math import inf
 
 
+from sqlalchemy.orm import column_property
+
 from src.config import db, ma
+from src.models.equipment_device import EquipmentDevice
 
 
-class Equipment(db.Model):
+equipment_change_seq = db.Sequence('equipment_change_seq')
+
+# id of the transaction that last wrote the row, see get_changes_since
+CURRENT_TRANSACTION_ID = db.text('(pg_current_xact_id()::text)::bigint')
+
+
+class EquipmentReading(db.Model):
+    """
+    The readings as stored: the equipment is referenced by the compact
+    equipment_device key instead of repeating its id on every row.
+    """
+
     __tablename__ = 'equipment'
 
-    id = db.Column(db.Integer, primary_key=True)
-    equipmentId = db.Column(db.String(255), nullable=False)
+    device_key = db.Column(db.Integer, db.ForeignKey('equipment_device.id'), nullable=False)
     timestamp = db.Column(db.DateTime(), nullable=False)
     value = db.Column(db.Float, nullable=True)
+    change_seq = db.Column(db.BigInteger, equipment_change_seq,
+                           server_default=equipment_change_seq.next_value(),
+                           nullable=False, unique=True)
+    change_xid = db.Column(db.BigInteger, server_default=CURRENT_TRANSACTION_ID,
+                           nullable=False)
 
     __table_args__ = (
-        db.UniqueConstraint('equipmentId', 'timestamp',
-                            name='unique_equipment_timestamp'),
+        db.PrimaryKeyConstraint('device_key', 'timestamp',
+                                name='equipment_pkey',
+                                postgresql_include=['value']),
+        # the timestamp dropdown reads its first values in order from it
+        db.Index('ix_equipment_timestamp', 'timestamp'),
     )
 
+
+class Equipment(db.Model):
+    """
+    Readings as the API sees them, with their equipmentId. Mapped over
+    equipment JOIN equipment_device, which Postgres never drops from a
+    plan: queries that don't need equipmentId read EquipmentReading.
+    """
+
+    __table__ = db.join(EquipmentReading.__table__, EquipmentDevice.__table__)
+
+    device_key = column_property(EquipmentReading.__table__.c.device_key,
+                                 EquipmentDevice.__table__.c.id)
+    equipmentId = EquipmentDevice.__table__.c.equipmentId
+
+    __mapper_args__ = {
+        'include_properties': ['device_key', 'equipmentId', 'timestamp', 'value',
+                               'change_seq', 'change_xid'],
+    }
+
     def __init__(
             self,
             equipmentId: str,
@@ -32,3 +75,61 @@ class EquipmentSchema(ma.Schema):
     class Meta:
         model = Equipment
         fields = ("equipmentId", "timestamp", "value")
+
+
+def encode_string(value) -> str:
+    return 'null' if value is None else encode_basestring_ascii(str(value))
+
+
+def encode_datetime(value: datetime) -> str:
+    return 'null' if value is None else f'"{value.isoformat()}"'
+
+
+def encode_number(value) -> str:
+    if value is None:
+        return 'null'
+    if value != value:
+        return 'NaN'
+    if value == inf:
+        return 'Infinity'
+    if value == -inf:
+        return '-Infinity'
+    return repr(value)
+
+
+FIELD_ENCODERS = {
+    'change_seq': encode_number,
+    'equipmentId': encode_string,
+    'timestamp': encode_datetime,
+    'value': encode_number,
+}
+
+
+class EquipmentRowEncoder():
+    """
+    Serializes Equipment column tuples straight to JSON, producing the same
+    bytes jsonify(EquipmentSchema(many=True).dump(...)) would, without
+    building ORM objects or going through marshmallow.
+
+    Rows must be selected with the columns in `columns`, which follow the
+    sorted key order jsonify writes.
+    """
+
+    def __init__(self, fields: tuple[str, ...] = EquipmentSchema.Meta.fields):
+        self.fields = tuple(sorted(fields))
+        self.columns = [getattr(Equipment, field) for field in self.fields]
+        self._encoders = [FIELD_ENCODERS[field] for field in self.fields]
+        self._template = '{' + ','.join(
+            f'{encode_basestring_ascii(field)}:%s' for field in self.fields) + '}'
+
+    def encode_row(self, row) -> str:
+        return self._template % tuple(
+            encoder(value) for encoder, value in zip(self._encoders, row))
+
+    def encode(self, rows) -> str:
+        return '[' + ','.join(self.encode_row(row) for row in rows) + ']'
+
+
+@lru_cache(maxsize=32)
+def get_row_encoder(fields: tuple[str, ...] = EquipmentSchema.Meta.fields) -> EquipmentRowEncoder:
+    return EquipmentRowEncoder(fields)
@@ -0,0 +1,38 @@
+from sqlalchemy import event, func, text
+from sqlalchemy.exc import DBAPIError
+
+from src.config import db
+from src.logs import logger
+
+
+class EquipmentDevice(db.Model):
+    """One row per equipmentId, kept in step with the readings."""
+
+    __tablename__ = 'equipment_device'
+
+    id = db.Column(db.Integer, primary_key=True)
+    equipmentId = db.Column(db.String(255), nullable=False, unique=True)
+    first_seen = db.Column(db.DateTime(), nullable=False)
+    last_seen = db.Column(db.DateTime(), nullable=False)
+
+
+db.Index('ix_equipment_device_equipment_id_prefix',
+         func.lower(EquipmentDevice.equipmentId).label('equipment_id_lower'),
+         postgresql_ops={'equipment_id_lower': 'text_pattern_ops'})
+
+
+@event.listens_for(EquipmentDevice.__table__, 'after_create')
+def create_trigram_index(target, connection, **kwargs):
+    """Substring search uses pg_trgm when the database has it; prefix search works without it."""
+    if connection.dialect.name != 'postgresql':
+        return
+
+    try:
+        with connection.begin_nested():
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            connection.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_equipment_device_equipment_id_trgm '
+                'ON equipment_device USING gin ("equipmentId" gin_trgm_ops)'))
+    except DBAPIError as ex:
+        logger.warning(
+            f'pg_trgm is not available, substring search of equipment ids will scan equipment_device: {ex.orig}')
@@ -0,0 +1,19 @@
+from src.config import db
+
+
+class EquipmentRollup(db.Model):
+    __tablename__ = 'equipment_rollup'
+
+    equipmentId = db.Column(db.String(255), primary_key=True)
+    granularity = db.Column(db.String(10), primary_key=True)
+    bucket_start = db.Column(db.DateTime(), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False)
+    sum = db.Column(db.Float, nullable=False)
+    sum_squares = db.Column(db.Float, nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_equipment_rollup_equipment_id_bucket_start',
+                 'equipmentId', 'bucket_start'),
+    )
@@ -0,0 +1,22 @@
+from src.config import db, ma
+
+
+class EquipmentSummary(db.Model):
+    """Latest reading and number of readings of every equipmentId."""
+
+    __tablename__ = 'equipment_summary'
+
+    equipmentId = db.Column(db.String(255), primary_key=True)
+    last_timestamp = db.Column(db.DateTime(), nullable=True)
+    last_value = db.Column(db.Float, nullable=True)
+    reading_count = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class EquipmentSummarySchema(ma.Schema):
+    class Meta:
+        model = EquipmentSummary
+        fields = ("equipmentId",
+                  "last_timestamp",
+                  "last_value",
+                  "reading_count",
+                  )
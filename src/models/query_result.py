@@ -0,0 +1,19 @@
+from sqlalchemy.dialects.postgresql import JSONB
+
+from src.config import db
+
+
+class QueryResult(db.Model):
+    """
+    Results of coalesced queries, shared between the uWSGI workers. Only
+    the latest result of each key is kept; the table is unlogged because
+    losing it on a crash only costs a recomputation.
+    """
+
+    __tablename__ = 'query_result'
+
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(JSONB, nullable=False)
+    created_at = db.Column(db.DateTime(), nullable=False)
+
+    __table_args__ = {'prefixes': ['UNLOGGED']}
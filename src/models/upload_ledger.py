@@ -0,0 +1,51 @@
+from datetime import datetime
+
+
+from src.config import db, ma
+
+
+class UploadLedger(db.Model):
+    __tablename__ = 'upload_ledger'
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True)
+    filename = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    rows_read = db.Column(db.BigInteger, nullable=False, default=0)
+    rows_written = db.Column(db.BigInteger, nullable=False, default=0)
+    chunks_skipped = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime(), nullable=False)
+
+    def __init__(
+            self,
+            content_hash: str,
+            filename: str,
+            status: str,
+            created_at: datetime,
+    ):
+        self.content_hash = content_hash
+        self.filename = filename
+        self.status = status
+        self.created_at = created_at
+
+
+class UploadChunk(db.Model):
+    __tablename__ = 'upload_chunk'
+
+    content_hash = db.Column(db.String(64), primary_key=True)
+    rows = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime(), nullable=False)
+
+
+class UploadLedgerSchema(ma.Schema):
+    class Meta:
+        model = UploadLedger
+        fields = ("content_hash",
+                  "filename",
+                  "status",
+                  "rows_read",
+                  "rows_written",
+                  "chunks_skipped",
+                  "created_at",
+                  )
@@ -2,3 +2,4 @@ from src.routers.user import login_blueprint, Login
 from src.routers.equipment import RouteEquipment, equipment_blueprint, load_columns, standardize_equipment_id
 from src.routers.user import register_blueprint, RouteRegister
 from src.routers.user import validate_token_blueprint, RouteValidateToken
+from src.routers.metrics import metrics_blueprint, RouteMetrics
@@ -1,79 +1,186 @@
 from contextlib import closing
 from datetime import datetime, timedelta
+from functools import lru_cache
 from http import HTTPStatus
 
 
-from flask import request
+from flask import abort, request
 from flask_restx import Resource
 from flask_smorest import Blueprint
 from flask_sqlalchemy.query import Query as BaseQuery
-from pandas import DataFrame, isna, read_csv
+from pandas import DataFrame, read_csv
 from sqlalchemy.orm import Session
-from sqlalchemy.sql import and_, func, or_, select
-from tempfile import TemporaryDirectory
-from werkzeug.utils import secure_filename
+from sqlalchemy.sql import Select, bindparam, func, select, text
 
 from src.config import db
-from src.helpers import CurrentTime, LogHelper
+from src.helpers import CurrentTime, EnvVarsTranslater, LogHelper, metrics
 from src.logs import logger
-from src.models import Equipment, EquipmentSchema
-from src.routers.helpers import configure_session, get_response, token_required
+from src.models import (
+    Equipment,
+    EquipmentReading,
+    EquipmentSchema,
+    EquipmentSummary,
+    EquipmentSummarySchema,
+    UploadLedgerSchema,
+    get_row_encoder
+)
+from src.routers.helpers import (
+    ACK_ON_ENQUEUE,
+    APPLIED,
+    CHANGE_FIELDS,
+    FAILED,
+    EncodedJson,
+    FACET_ORDERS,
+    HashingStream,
+    MAX_CHANGES_LIMIT,
+    MAX_FACET_LIMIT,
+    MAX_STATS_EQUIPMENTS,
+    SingleFlight,
+    UPLOAD_COLUMNS,
+    UPLOAD_DTYPES,
+    UploadMeter,
+    admission_controlled,
+    configure_session,
+    find_applied_upload,
+    get_changes_since,
+    get_encoded_response,
+    get_facets,
+    get_overload_response,
+    get_read_target,
+    get_response,
+    get_rollup_rows_query,
+    get_rollup_totals,
+    get_stats,
+    get_upload_chunk_rows,
+    get_upload_stream,
+    get_upload_workers,
+    get_write_buffer,
+    get_write_buffer_ack,
+    hash_chunk,
+    hash_stream,
+    ingest_partitions,
+    is_chunk_applied,
+    is_compacted,
+    is_overload_error,
+    is_write_buffer_enabled,
+    iter_csv_streams,
+    mark_primary_write,
+    normalize_timestamp,
+    open_stream,
+    partition_rows,
+    read_from_replica,
+    record_chunk,
+    record_upload,
+    search_devices,
+    standardize_equipment_id,
+    token_required,
+    upload_executors,
+    upsert_readings
+)
 
 equipment_blueprint = Blueprint("Equipment", __name__)
 
+MAX_SEARCH_LIMIT = 100
 
-def normalize_timestamp(ts):
-    if isinstance(ts, str):
-        return datetime.fromisoformat(ts).replace(tzinfo=None)
-    return ts.replace(tzinfo=None)
+# dashboards opening at the same time share one computation of the dropdown
+dropdown_flight = SingleFlight(
+    'dropdown', across_workers=EnvVarsTranslater.get_bool('COALESCE_ACROSS_WORKERS', default=False))
 
+DROPDOWN_AVERAGES = {
+    'last_24': timedelta(hours=24),
+    'last_48': timedelta(hours=48),
+    'last_week': timedelta(weeks=1),
+    'last_month': timedelta(days=30),
+}
 
-def calculate_average(query: BaseQuery, time_delta: datetime):
-    now = datetime.now()
+# the hot statements are built once with bind parameters, so requests only
+# bind their values and SQLAlchemy reuses the compiled SQL
+LISTING_ORDER = (Equipment.equipmentId, Equipment.timestamp)
 
-    if time_delta == timedelta(hours=24):
-        start_time = now - timedelta(days=1)
-    elif time_delta == timedelta(hours=48):
-        start_time = now - timedelta(days=2)
-    elif time_delta == timedelta(weeks=1):
-        start_time = now - timedelta(weeks=1)
-    elif time_delta == timedelta(days=30):
-        start_time = now - timedelta(days=30)
-    else:
+WINDOW_FILTERS = (
+    Equipment.equipmentId == bindparam('equipment_id'),
+    Equipment.value != None,
+    Equipment.timestamp >= bindparam('start_time'),
+    Equipment.timestamp <= bindparam('end_time'),
+)
+
+AVERAGE_STATEMENT = select(func.avg(Equipment.value)).where(*WINDOW_FILTERS)
+
+TOTALS_STATEMENT = select(func.coalesce(func.sum(Equipment.value), 0.0),
+                          func.count(Equipment.value)).where(*WINDOW_FILTERS)
+
+
+def get_window_start(filter_by: list) -> datetime | None:
+    for window, time_delta in DROPDOWN_AVERAGES.items():
+        if window in filter_by:
+            return (datetime.now() - time_delta).replace(
+                hour=0, minute=0, second=0, microsecond=0)
+
+    return None
+
+
+def calculate_average(equipment_id: str, time_delta: timedelta):
+    window = next((window for window, delta in DROPDOWN_AVERAGES.items()
+                   if delta == time_delta), None)
+    if window is None:
         raise ValueError("Unsupported time_delta")
 
-    start_time = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
-    end_time = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+    now = datetime.now()
+    params = {
+        'equipment_id': equipment_id,
+        'start_time': get_window_start([window]),
+        'end_time': now.replace(hour=23, minute=59, second=59, microsecond=999999),
+    }
+
+    if is_compacted(equipment_id, params['start_time']):
+        raw_total, raw_count = db.session.execute(TOTALS_STATEMENT, params).one()
+        rollup_total, rollup_count = get_rollup_totals(
+            db.session, equipment_id, params['start_time'], params['end_time'])
+
+        count = raw_count + rollup_count
+        return round((raw_total + rollup_total) / count, 2) if count else None
 
-    filtered_query = query.filter(
-        Equipment.timestamp >= start_time, Equipment.timestamp <= end_time)
-    avg_value = filtered_query.with_entities(
-        func.avg(Equipment.value)).scalar()
+    avg_value = db.session.execute(AVERAGE_STATEMENT, params).scalar()
     return round(avg_value, 2) if avg_value is not None else None
 
 
 @equipment_blueprint.route("/equipment")
 class RouteEquipment(Resource):
     @token_required
+    @admission_controlled(lambda: 'heavy' if request.args.get('column_name') else 'default')
+    @read_from_replica
     def get(self):
+        column_name = request.args.get('column_name')
+
+        try:
+            fields = get_requested_fields(column_name)
+            facet_order, facet_limit = get_facet_options()
+        except ValueError as ex:
+            return get_response(HTTPStatus.BAD_REQUEST, str(ex))
+
         try:
-            column_name = request.args.get('column_name')
             filter_by = request.args.getlist('filter_by')
             query = db.session.query(Equipment)
 
             if column_name:
-                dropdown_options = query_column(column_name, query)
+                dropdown_options = query_column(
+                    column_name, query, fields, facet_order, facet_limit)
                 total_rows = len(dropdown_options)
                 return get_response(HTTPStatus.OK, {
-                    'equipments': sorted(dropdown_options, key=lambda item: item['value']),
+                    'equipments': dropdown_options,
                     'total': total_rows
                 })
 
-            query = add_query_filters(query, filter_by)
-
-            result = get_rows_paginated(query)
+            encoder = get_row_encoder(fields)
 
-            total_count = query.count()
+            rollup_query = get_rollup_query(encoder.fields, filter_by)
+            if rollup_query is not None:
+                query = add_query_filters(
+                    db.session.query(*encoder.columns), filter_by).union_all(rollup_query)
+                result = get_rows_paginated(query, order_by=get_union_order(encoder.fields))
+                total_count = query.count()
+            else:
+                result, total_count = get_listing_page(encoder.fields, filter_by)
 
             if not result:
                 return get_response(HTTPStatus.OK, {'total': total_count,
@@ -82,16 +189,21 @@ class RouteEquipment(Resource):
 
             logger.info('get all equipments')
 
-            return get_response(HTTPStatus.OK, {'total': total_count,
-                                                'equipments': EquipmentSchema(many=True).dump(result),
-                                                'message': 'Request happened successfully'})
+            return get_encoded_response(HTTPStatus.OK, {'total': total_count,
+                                                        'equipments': EncodedJson(encoder.encode(result)),
+                                                        'message': 'Request happened successfully'})
         except Exception as ex:
+            overloaded = get_overload_response(ex)
+            if overloaded is not None:
+                return overloaded
+
             msg = f'Unable to get equipment list. Error: {str(ex)}'
             log_msg = LogHelper.get_log_msg(msg, request)
             logger.exception(log_msg)
             return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
 
     @token_required
+    @admission_controlled('default')
     def post(self):
         body = request.get_json() if request.get_json() else dict()
 
@@ -101,118 +213,388 @@ class RouteEquipment(Resource):
         if not (equipmentId):
             return get_response(HTTPStatus.BAD_REQUEST, "equipmentId field must be sent")
 
-        new_equipment = Equipment(
-            equipmentId=equipmentId,
-            timestamp=CurrentTime.current_time(),
-            value=value
-        )
+        try:
+            with metrics.timer('equipment.post'):
+                if is_write_buffer_enabled():
+                    return buffer_reading(equipmentId, value)
+
+                new_equipment = {
+                    'equipmentId': equipmentId,
+                    'timestamp': CurrentTime.current_datetime(),
+                    'value': value,
+                }
+
+                upsert_readings(db.session, [new_equipment])
+                db.session.commit()
+                metrics.increment('equipment.commits')
+                mark_primary_write()
+                logger.info(f'Category created: {new_equipment}')
+                return get_response(HTTPStatus.CREATED, EquipmentSchema().dump(new_equipment))
+        except Exception as ex:
+            overloaded = get_overload_response(ex)
+            if overloaded is not None:
+                return overloaded
+
+            msg = f'Unable to add equipment reading. Error: {str(ex)}'
+            log_msg = LogHelper.get_log_msg(msg, request)
+            logger.exception(log_msg)
+            return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
 
-        db.session.add(new_equipment)
-        db.session.commit()
-        logger.info(f'Category created: {new_equipment}')
-        return get_response(HTTPStatus.CREATED, EquipmentSchema().dump(new_equipment))
+
+def buffer_reading(equipment_id: str, value: float):
+    reading = {
+        'equipmentId': equipment_id,
+        'timestamp': CurrentTime.current_datetime(),
+        'value': value,
+    }
+
+    write_buffer = get_write_buffer()
+    pending = write_buffer.enqueue(reading)
+    mark_primary_write()
+
+    if get_write_buffer_ack() == ACK_ON_ENQUEUE:
+        return get_response(HTTPStatus.ACCEPTED, EquipmentSchema().dump(reading))
+
+    if pending.wait():
+        return get_response(HTTPStatus.CREATED, EquipmentSchema().dump(reading))
+
+    # still queued: dropped, so the client can safely send it again
+    if write_buffer.withdraw(pending):
+        return get_response(HTTPStatus.SERVICE_UNAVAILABLE,
+                            'The reading was not written in time and was discarded, please send it again')
+
+    # its batch is being written: it will be stored unless the batch fails
+    if pending.wait(timeout=0):
+        return get_response(HTTPStatus.CREATED, EquipmentSchema().dump(reading))
+    return get_response(HTTPStatus.ACCEPTED, EquipmentSchema().dump(reading))
+
+
+@equipment_blueprint.route("/equipment/ids")
+class RouteEquipmentIds(Resource):
+    @token_required
+    @admission_controlled('default')
+    @read_from_replica
+    def get(self):
+        q = request.args.get('q', '').strip()
+
+        try:
+            limit = int(request.args.get('limit', 20))
+            if not 0 < limit <= MAX_SEARCH_LIMIT:
+                raise ValueError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}")
+
+            fields = get_requested_fields('equipmentId') \
+                if request.args.getlist('fields') else ('value', 'label')
+        except ValueError as ex:
+            return get_response(HTTPStatus.BAD_REQUEST, str(ex))
+
+        try:
+            equipment_options = [get_equipment_option(equipment_id, fields)
+                                 for equipment_id in search_devices(db.session, q, limit)]
+
+            return get_response(HTTPStatus.OK, {
+                'equipments': equipment_options,
+                'total': len(equipment_options)
+            })
+        except Exception as ex:
+            overloaded = get_overload_response(ex)
+            if overloaded is not None:
+                return overloaded
+
+            msg = f'Unable to search equipment ids. Error: {str(ex)}'
+            log_msg = LogHelper.get_log_msg(msg, request)
+            logger.exception(log_msg)
+            return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
+
+
+@equipment_blueprint.route("/equipment/stats")
+class RouteEquipmentStats(Resource):
+    @token_required
+    @admission_controlled('heavy')
+    @read_from_replica
+    def post(self):
+        body = request.get_json(silent=True) or dict()
+
+        try:
+            equipment_ids, windows, percentiles = get_stats_request(body)
+        except ValueError as ex:
+            return get_response(HTTPStatus.BAD_REQUEST, str(ex))
+
+        try:
+            with_rollups = any(is_compacted(equipment_id, start_time)
+                               for equipment_id in equipment_ids
+                               for start_time, _ in windows.values())
+
+            stats = get_stats(
+                db.session, equipment_ids, windows, percentiles, with_rollups)
+
+            response = get_response(HTTPStatus.OK, {'stats': stats})
+            response.add_etag()
+            response.headers['Cache-Control'] = 'private, no-cache'
+
+            if request.if_none_match.contains(response.get_etag()[0]):
+                response.status_code = HTTPStatus.NOT_MODIFIED
+                response.set_data(b'')
+
+            return response
+        except Exception as ex:
+            overloaded = get_overload_response(ex)
+            if overloaded is not None:
+                return overloaded
+
+            msg = f'Unable to get equipment stats. Error: {str(ex)}'
+            log_msg = LogHelper.get_log_msg(msg, request)
+            logger.exception(log_msg)
+            return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
+
+
+@equipment_blueprint.route("/equipment/summary")
+class RouteEquipmentSummary(Resource):
+    @token_required
+    @admission_controlled('default')
+    @read_from_replica
+    def get(self):
+        equipment_ids = {
+            equipment_id.strip()
+            for equipment_ids in request.args.getlist('equipmentId')
+            for equipment_id in equipment_ids.split(',')
+            if equipment_id.strip()
+        }
+
+        try:
+            query = db.session.query(EquipmentSummary)
+            if equipment_ids:
+                query = query.filter(EquipmentSummary.equipmentId.in_(equipment_ids))
+
+            result = get_rows_paginated(query, order_by=EquipmentSummary.equipmentId)
+
+            return get_response(HTTPStatus.OK, {
+                'equipments': EquipmentSummarySchema(many=True).dump(result),
+                'total': query.count()
+            })
+        except Exception as ex:
+            overloaded = get_overload_response(ex)
+            if overloaded is not None:
+                return overloaded
+
+            msg = f'Unable to get equipment summary. Error: {str(ex)}'
+            log_msg = LogHelper.get_log_msg(msg, request)
+            logger.exception(log_msg)
+            return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
+
+
+@equipment_blueprint.route("/equipment/changes")
+class RouteEquipmentChanges(Resource):
+    @token_required
+    @admission_controlled('default')
+    def get(self):
+        try:
+            since = int(request.args.get('since', 0))
+            limit = int(request.args.get('limit', 1000))
+        except ValueError:
+            return get_response(HTTPStatus.BAD_REQUEST, "since and limit must be integers")
+
+        if since < 0 or not 0 < limit <= MAX_CHANGES_LIMIT:
+            return get_response(HTTPStatus.BAD_REQUEST, f"since must be positive and limit between 1 and {
+                                MAX_CHANGES_LIMIT}")
+
+        try:
+            changes = get_changes_since(db.session, since, limit)
+            next_since = changes[-1][0] if changes else since
+
+            return get_encoded_response(HTTPStatus.OK, {
+                'changes': EncodedJson(get_row_encoder(CHANGE_FIELDS).encode(changes)),
+                'next_since': next_since,
+                'has_more': len(changes) == limit})
+        except Exception as ex:
+            overloaded = get_overload_response(ex)
+            if overloaded is not None:
+                return overloaded
+
+            msg = f'Unable to get equipment changes. Error: {str(ex)}'
+            log_msg = LogHelper.get_log_msg(msg, request)
+            logger.exception(log_msg)
+            return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
+
+
+@equipment_blueprint.route("/equipment/stream")
+class RouteEquipmentStream(Resource):
+    @token_required
+    def get(self):
+        equipment_ids = {
+            equipment_id.strip()
+            for equipment_ids in request.args.getlist('equipmentId')
+            for equipment_id in equipment_ids.split(',')
+            if equipment_id.strip()
+        }
+
+        if not equipment_ids:
+            return get_response(HTTPStatus.BAD_REQUEST, "equipmentId parameter must be sent")
+
+        last_event_id = request.headers.get(
+            'Last-Event-ID', request.args.get('last_event_id'))
+
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            return get_response(HTTPStatus.BAD_REQUEST, "Last-Event-ID must be an integer")
+
+        logger.info(f"Streaming readings of {', '.join(sorted(equipment_ids))}")
+
+        return open_stream(equipment_ids, last_event_id)
 
 
 @equipment_blueprint.route("/equipment/upload")
 class RouteUploadEquipmentFile(Resource):
     @token_required
+    @admission_controlled('upload')
     def post(self):
+        force = request.args.get('force', 'false').lower() == 'true'
+
         with closing(configure_session()) as session:
+            filename, content_hash = None, None
+
             try:
-                read_file(session)
+                filename, stream = get_upload_stream(request)
+                hashing_stream = None
+
+                if stream.seekable():
+                    content_hash = hash_stream(stream)
+                    applied_upload = None if force else find_applied_upload(
+                        session, content_hash)
+
+                    if applied_upload:
+                        logger.info(f"File '{filename}' was already applied as {
+                                    content_hash}, skipping it")
+                        return get_response(HTTPStatus.OK, {
+                            'message': 'File already uploaded and processed',
+                            'upload': UploadLedgerSchema().dump(applied_upload)})
+                else:
+                    stream = hashing_stream = HashingStream(stream)
+
+                stats = read_file(session, filename, stream, force)
+
+                if hashing_stream:
+                    content_hash = hashing_stream.hexdigest()
+
+                upload = record_upload(
+                    session, content_hash, filename, APPLIED, stats)
                 session.commit()
+                mark_primary_write()
 
                 return get_response(HTTPStatus.OK, {
-                    'message': 'File successfully uploaded and processed'})
+                    'message': 'File successfully uploaded and processed',
+                    'upload': UploadLedgerSchema().dump(upload),
+                    'ingest': stats['ingest']})
 
             except Exception as ex:
                 session.rollback()
+                overloaded = get_overload_response(ex)
+                if overloaded is not None:
+                    return overloaded
+
                 msg = f'Unable to upload file. Rollback executed. Error: {
                     str(ex)}'
                 log_msg = LogHelper.get_log_msg(msg, request)
                 logger.exception(log_msg)
-                return get_response(HTTPStatus.BAD_REQUEST, msg)
-
-
-def read_file(session: Session):
-    if 'file' not in request.files:
-        raise Exception(f"The file key 'file' must be sent")
-
-    file_uploaded = request.files['file']
-
-    filename = secure_filename(file_uploaded.filename)
-
-    with TemporaryDirectory():
-        temporary_path: str = f"src/temporary/{filename}"
-        file_uploaded.save(temporary_path)
-
-        try:
-            workbook = read_csv(temporary_path, delimiter=';')
-            add_equipment_info(session, workbook)
 
-            logger.info(f"Extracted data from CSV file: '{
-                        filename}' successfully"
-                        )
+                if content_hash:
+                    record_upload(session, content_hash,
+                                  filename, FAILED, message=str(ex))
+                    session.commit()
 
-        except TypeError as e:
-            logger.error(f"Type error while processing file '{filename}': {e}")
-            raise
+                return get_response(HTTPStatus.BAD_REQUEST, msg)
 
-        except Exception as e:
-            msg = f"Error extracting data from file '{filename}': {str(e)}"
-            logger.error(msg)
-            raise Exception(msg)
 
+def read_file(session: Session, filename: str, stream, force: bool = False) -> dict:
+    stats = {'rows_read': 0, 'rows_written': 0, 'chunks_skipped': 0}
+    meter = UploadMeter()
 
-def add_equipment_info(session: Session, workbook: DataFrame) -> None:
+    with upload_executors() as executors:
+        for csv_name, csv_stream in iter_csv_streams(filename, stream):
+            try:
+                for workbook in read_csv(csv_stream,
+                                         delimiter=';',
+                                         usecols=lambda column: column in UPLOAD_COLUMNS,
+                                         dtype=UPLOAD_DTYPES,
+                                         chunksize=get_upload_chunk_rows()):
+                    meter.sample()
+                    chunk_stats = add_equipment_info(
+                        session, workbook, executors, force, meter)
+
+                    for key, value in chunk_stats.items():
+                        stats[key] += value
+
+                    # a chunk per transaction: the change feed holds back
+                    # newer changes while a writing transaction is open
+                    session.commit()
+
+                    # released before the reader parses the next chunk
+                    del workbook
+
+                logger.info(f"Extracted data from CSV file: '{
+                            csv_name}' successfully"
+                            )
+
+            except TypeError as e:
+                logger.error(
+                    f"Type error while processing file '{csv_name}': {e}")
+                raise
+
+            except Exception as e:
+                if is_overload_error(e):
+                    raise
+
+                msg = f"Error extracting data from file '{
+                    csv_name}': {str(e)}"
+                logger.error(msg)
+                raise Exception(msg)
+
+    stats['ingest'] = ingest = meter.report(stats['rows_read'])
+    metrics.observe('equipment.upload', ingest['elapsed_seconds'])
+    metrics.increment('equipment.upload.rows', stats['rows_read'])
+    logger.info(f"Read {stats['rows_read']} rows from '{filename}' in {ingest['elapsed_seconds']}s "
+                f"({ingest['rows_per_second']} rows/s), peak memory {ingest['peak_memory_mb']} MB")
+
+    return stats
+
+
+def add_equipment_info(session: Session,
+                       workbook: DataFrame,
+                       executors=None,
+                       force: bool = False,
+                       meter: UploadMeter | None = None) -> dict:
     header_list = {
         'equipmentId',
         'timestamp',
         'value',
     }
 
-    relevant_columns_list, rows_by_equipment_id_and_timestamp = load_columns(
+    validate_columns(workbook, header_list)
+
+    chunk_hash = hash_chunk(workbook, sorted(header_list))
+    if not force and is_chunk_applied(session, chunk_hash):
+        logger.debug(f"Chunk {chunk_hash} was already applied, skipping it")
+        return {'rows_read': len(workbook), 'rows_written': 0, 'chunks_skipped': 1}
+
+    relevant_columns_list, partitions = load_columns(
         workbook=workbook,
         header_list=header_list
     )
+    if meter:
+        meter.sample()
 
-    modified_rows = []
-
-    new_row = False
+    written_rows = ingest_partitions(session, partitions, executors)
+    record_chunk(session, chunk_hash, written_rows)
+    if meter:
+        meter.sample()
 
-    for columns in relevant_columns_list:
-        equipment_id = standardize_equipment_id(columns['equipmentId'])
-        timestamp = normalize_timestamp(
-            standardize_timestamp(columns['timestamp']))
+    logger.debug(f"{written_rows} of {
+                 len(relevant_columns_list)} rows written")
 
-        value: float = columns.get('value')
-        if isna(value):
-            value = None
+    return {'rows_read': len(relevant_columns_list), 'rows_written': written_rows, 'chunks_skipped': 0}
 
-        row_key = (equipment_id, timestamp)
-
-        row: Equipment = rows_by_equipment_id_and_timestamp.get(row_key)
-
-        if not row:
-            session.add(Equipment(
-                equipmentId=equipment_id,
-                timestamp=timestamp,
-                value=value
-            ))
-            new_row = True
-        else:
-            row.value = value
-            modified_rows.append(row)
-
-        if modified_rows or new_row:
-            session.bulk_save_objects(modified_rows)
-            session.commit()
-
-
-def load_columns(workbook: DataFrame, header_list: set) -> list:
-    logger.debug(
-        f"Start time {datetime.today().strftime('%d/%m/%Y, %H:%M:%S')}")
 
+def validate_columns(workbook: DataFrame, header_list: set) -> None:
     missing_columns = [
         col for col in header_list if col not in workbook.columns]
     if missing_columns:
@@ -220,175 +602,288 @@ def load_columns(workbook: DataFrame, header_list: set) -> list:
                          ', '.join(missing_columns)}"
                          )
 
-    relevant_columns_df = workbook[list(header_list)].copy()
-
-    relevant_columns_list = relevant_columns_df.to_dict(orient='records')
 
-    equipment_ids_and_timestamps = [
-        (standardize_equipment_id(row['equipmentId']),
-         standardize_timestamp(row['timestamp']))
-        for row in relevant_columns_list
-        if row.get('equipmentId') is not None and row.get('timestamp') is not None
-    ]
+def load_columns(workbook: DataFrame, header_list: set) -> list:
+    logger.debug(
+        f"Start time {datetime.today().strftime('%d/%m/%Y, %H:%M:%S')}")
 
-    with closing(configure_session()) as session:
-        conditions = [
-            and_(Equipment.equipmentId == equipment_id,
-                 Equipment.timestamp == timestamp)
-            for equipment_id, timestamp in equipment_ids_and_timestamps
-        ]
+    validate_columns(workbook, header_list)
 
-        rows = session.execute(
-            select(Equipment).where(or_(*conditions))
-        ).scalars().all()
+    relevant_columns_list = workbook[list(header_list)].to_dict(orient='records')
 
-    rows_by_equipment_id_and_timestamp = {
-        (row.equipmentId, row.timestamp): row for row in rows
-    }
+    partitions = partition_rows(relevant_columns_list, get_upload_workers())
 
     logger.debug(f"End time {datetime.today().strftime('%d/%m/%Y, %H:%M:%S')}")
 
-    return relevant_columns_list, rows_by_equipment_id_and_timestamp
+    return relevant_columns_list, partitions
 
 
-def standardize_equipment_id(equipment_id: str) -> str:
-    if isna(equipment_id):
-        equipment_id = ''
-    else:
-        equipment_id = str(equipment_id)
+def get_page_args() -> tuple[int, int]:
+    page = int(request.args.get('page')) if request.args.get('page') else 1
+    per_page = int(request.args.get('per_page')
+                   ) if request.args.get('per_page') else 100
+
+    return page, per_page
+
+
+def get_rows_paginated(query: BaseQuery, order_by=Equipment.equipmentId):
+    page, per_page = get_page_args()
+
+    result: list = query.order_by(order_by).paginate(
+        page=page, per_page=per_page, count=False).items
+
+    return result
 
-    equipment_id = equipment_id.strip()
-    if not equipment_id:
-        raise ValueError(
-            "A coluna equipmentId não está preenchida corretamente (existe algum valor que está em branco, por exemplo).")
 
-    return equipment_id
+def get_listing_page(fields: tuple[str, ...], filter_by: list) -> tuple[list, int]:
+    """One page of readings and the total, paginated like get_rows_paginated."""
+    page, per_page = get_page_args()
+    if page < 1 or per_page < 1:
+        abort(HTTPStatus.NOT_FOUND)
 
+    params = get_listing_params(filter_by)
+    rows_statement, count_statement = get_listing_statements(fields, tuple(params))
 
-def standardize_timestamp(timestamp: datetime) -> datetime:
-    if isna(timestamp):
-        timestamp = ''
+    result = db.session.execute(rows_statement, {**params,
+                                                 'limit': per_page,
+                                                 'offset': (page - 1) * per_page}).all()
+    if not result and page != 1:
+        abort(HTTPStatus.NOT_FOUND)
+
+    return result, db.session.execute(count_statement, params).scalar()
+
+
+def get_union_order(fields: tuple[str, ...]):
+    """LISTING_ORDER for a union, which only exposes the selected columns, by position."""
+    positions = [str(fields.index(column.key) + 1)
+                 for column in LISTING_ORDER if column.key in fields]
+    return text(', '.join(positions or ['1']))
+
+
+@lru_cache(maxsize=64)
+def get_listing_statements(fields: tuple[str, ...], filters: tuple[str, ...]) -> tuple[Select, Select]:
+    conditions = get_listing_conditions(filters)
+
+    # equipment_device's unique index walks the equipments in order and
+    # equipment_pkey each one's readings, so Postgres sorts one equipment at a time
+    rows_statement = select(*get_row_encoder(fields).columns) \
+        .where(*conditions) \
+        .order_by(*LISTING_ORDER) \
+        .limit(bindparam('limit')) \
+        .offset(bindparam('offset'))
+
+    # the readings alone give the count unless it filters by equipmentId
+    counted = Equipment if 'equipment_id' in filters else EquipmentReading
+    count_statement = select(func.count()).select_from(counted) \
+        .where(*get_listing_conditions(filters, counted))
+
+    return rows_statement, count_statement
+
+
+def get_requested_fields(column_name: str | None = None) -> tuple[str, ...]:
+    if column_name and column_name not in EquipmentSchema.Meta.fields:
+        raise ValueError(f"Unknown column_name '{column_name}'. Allowed columns: {
+                         ', '.join(EquipmentSchema.Meta.fields)}")
+
+    if column_name == 'equipmentId':
+        allowed_fields = default_fields = ('value', 'label', *DROPDOWN_AVERAGES)
+    elif column_name:
+        allowed_fields = ('value', 'label', 'count')
+        with_counts = request.args.get('counts', 'false').lower() == 'true'
+        default_fields = allowed_fields if with_counts else ('value', 'label')
     else:
-        timestamp = timestamp
+        allowed_fields = default_fields = EquipmentSchema.Meta.fields
 
-    timestamp = timestamp.strip()
-    if not timestamp:
-        raise ValueError(
-            "A coluna timestamp não está preenchida corretamente (existe algum valor que está em branco, por exemplo).")
+    requested_fields = [
+        field.strip()
+        for fields in request.args.getlist('fields')
+        for field in fields.split(',')
+        if field.strip()
+    ]
 
-    return timestamp
+    if not requested_fields:
+        return tuple(default_fields)
 
+    unknown_fields = [
+        field for field in requested_fields if field not in allowed_fields]
+    if unknown_fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown_fields)}. Allowed fields: {
+                         ', '.join(allowed_fields)}")
 
-def get_rows_paginated(query: BaseQuery):
-    page = int(request.args.get('page')) if request.args.get('page') else 1
-    per_page = int(request.args.get('per_page')
-                   ) if request.args.get('per_page') else 100
+    return tuple(dict.fromkeys(requested_fields))
 
-    result: Equipment = query.order_by(Equipment.equipmentId).paginate(
-        page=page, per_page=per_page).items
 
-    return result
+def get_stats_request(body: dict) -> tuple[list[str], dict, list[float]]:
+    equipment_ids = body.get('equipmentIds')
+    if not isinstance(equipment_ids, list) or not equipment_ids or \
+            not all(isinstance(equipment_id, str) for equipment_id in equipment_ids):
+        raise ValueError("equipmentIds must be a list of equipment ids")
+
+    equipment_ids = list(dict.fromkeys(equipment_ids))
+    if len(equipment_ids) > MAX_STATS_EQUIPMENTS:
+        raise ValueError(
+            f"At most {MAX_STATS_EQUIPMENTS} equipmentIds can be sent at once")
+
+    end_of_today = datetime.now().replace(
+        hour=23, minute=59, second=59, microsecond=999999)
+    windows = {}
 
+    for window in body.get('windows') or []:
+        if window not in DROPDOWN_AVERAGES:
+            raise ValueError(f"Unknown window '{window}'. Allowed windows: {
+                             ', '.join(DROPDOWN_AVERAGES)}")
+        windows[window] = (get_window_start([window]), end_of_today)
 
-def query_column(column_name: str, query: BaseQuery):
-    with closing(configure_session()) as session:
+    if body.get('start') or body.get('end'):
         try:
-            dropdown_options = []
-            if column_name == 'equipmentId':
-                equipments: list[Equipment] = (
-                    query.with_entities(Equipment.equipmentId)
-                    .filter(Equipment.value != None)
-                    .distinct()
-                    .order_by(Equipment.equipmentId)
-                    .all()
-                )
-
-                for equipment in equipments:
-                    equipment_id = equipment.equipmentId
-
-                    equipment_query = db.session.query(Equipment).filter(
-                        Equipment.equipmentId == equipment_id,
-                        Equipment.value != None
-                    )
-
-                    last_24 = calculate_average(
-                        equipment_query, timedelta(hours=24))
-                    last_48 = calculate_average(
-                        equipment_query, timedelta(hours=48))
-                    last_week = calculate_average(
-                        equipment_query, timedelta(weeks=1))
-                    last_month = calculate_average(
-                        equipment_query, timedelta(days=30))
-
-                    dropdown_options.append({
-                        'value': equipment_id,
-                        'label': equipment_id,
-                        'last_24': last_24,
-                        'last_48': last_48,
-                        'last_week': last_week,
-                        'last_month': last_month,
-                    })
-
-                return dropdown_options
-            else:
-                equipments = query.distinct(db.Column(column_name)).all()
+            start_time = normalize_timestamp(body['start'])
+            end_time = normalize_timestamp(body['end'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("start and end must both be sent as ISO 8601 timestamps")
+        windows['range'] = (start_time, end_time)
 
-                for equipment in equipments:
-                    value: str | datetime = getattr(equipment, column_name)
-                    if value:
-                        dictionary = {'label': value, 'value': value}
-                        dropdown_options.append(dictionary)
+    if not windows:
+        raise ValueError("Send windows, a start and end range, or both")
 
-                return dropdown_options
+    percentiles = body.get('percentiles') or []
+    if not isinstance(percentiles, list) or not all(
+            isinstance(percentile, (int, float)) and 0 <= percentile <= 100
+            for percentile in percentiles):
+        raise ValueError("percentiles must be a list of numbers between 0 and 100")
 
-        except:
-            msg = 'No able to get dropdown options. Rollback executed'
-            session.rollback()
-            logger.exception(msg)
-            return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
+    return equipment_ids, windows, [float(percentile) for percentile in percentiles]
 
 
-def add_query_filters(query: BaseQuery, filter_by: list) -> BaseQuery:
+def get_facet_options() -> tuple[str, int | None]:
+    order = request.args.get('order', 'value')
+    if order not in FACET_ORDERS:
+        raise ValueError(f"Unknown order '{order}'. Allowed orders: {
+                         ', '.join(FACET_ORDERS)}")
+
+    limit = request.args.get('limit')
+    try:
+        limit = int(limit) if limit else None
+    except ValueError:
+        raise ValueError("limit must be an integer")
+
+    if limit is not None and not 0 < limit <= MAX_FACET_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_FACET_LIMIT}")
+
+    return order, limit
+
+
+def get_equipment_option(equipment_id: str, fields: tuple[str, ...] = ('value', 'label')) -> dict:
+    option = {
+        'value': equipment_id,
+        'label': equipment_id,
+    }
+
+    for average in fields:
+        if average in DROPDOWN_AVERAGES:
+            option[average] = calculate_average(equipment_id, DROPDOWN_AVERAGES[average])
+
+    return {field: option[field] for field in fields}
+
+
+def get_equipment_options(query: BaseQuery, fields: tuple[str, ...]) -> list[dict]:
+    equipments: list[Equipment] = (
+        query.with_entities(Equipment.equipmentId)
+        .filter(Equipment.value != None)
+        .distinct()
+        .order_by(Equipment.equipmentId)
+        .all()
+    )
+
+    return [get_equipment_option(equipment.equipmentId, fields) for equipment in equipments]
+
+
+def query_column(column_name: str,
+                 query: BaseQuery,
+                 fields: tuple[str, ...] = ('value', 'label'),
+                 order: str = 'value',
+                 limit: int | None = None):
+    try:
+        dropdown_options = []
+        if column_name == 'equipmentId':
+            # a client pinned to the primary must not get a result read on a replica
+            return dropdown_flight.do((get_read_target(), fields),
+                                      lambda: get_equipment_options(query, fields))
+        else:
+            for value, count in get_facets(query.session, column_name, order, limit):
+                option = {'label': value, 'value': value, 'count': count}
+                dropdown_options.append(
+                    {field: option[field] for field in fields})
+
+            return dropdown_options
+
+    except Exception as ex:
+        db.session.rollback()
+        if is_overload_error(ex):
+            raise
+
+        msg = 'No able to get dropdown options. Rollback executed'
+        logger.exception(msg)
+        return get_response(HTTPStatus.INTERNAL_SERVER_ERROR, msg)
+
+
+def get_rollup_query(fields: tuple[str, ...], filter_by: list) -> BaseQuery | None:
+    """The compacted buckets of the filtered equipment, one row per hour or day, if any."""
+    equipment_id = request.args.get('equipmentId')
+    start_time = get_window_start(filter_by)
+
+    if not equipment_id or request.args.get('timestamp') or request.args.get('value'):
+        return None
+
+    if not is_compacted(equipment_id, start_time):
+        return None
+
+    return get_rollup_rows_query(db.session, fields, equipment_id, start_time)
+
+
+def get_listing_params(filter_by: list) -> dict:
     equipment_id = request.args.get('equipmentId')
     timestamp = request.args.get('timestamp')
     value = request.args.get('value')
 
+    params = {}
+
     if equipment_id:
-        query = query.filter(
-            Equipment.equipmentId == equipment_id,
-            Equipment.value != None
-        )
+        params['equipment_id'] = equipment_id
 
-        now = datetime.now()
+        start_time = get_window_start(filter_by)
+        if start_time is not None:
+            params['start_time'] = start_time
 
-        if 'last_24' in filter_by:
-            start_time = now - timedelta(days=1)
-            start_time = start_time.replace(
-                hour=0, minute=0, second=0, microsecond=0)
-            query = query.filter(Equipment.timestamp >= start_time)
+    if timestamp:
+        params['timestamp'] = timestamp
 
-        elif 'last_48' in filter_by:
-            start_time = now - timedelta(days=2)
-            start_time = start_time.replace(
-                hour=0, minute=0, second=0, microsecond=0)
-            query = query.filter(Equipment.timestamp >= start_time)
+    if value:
+        params['value'] = value
 
-        elif 'last_week' in filter_by:
-            start_time = now - timedelta(weeks=1)
-            start_time = start_time.replace(
-                hour=0, minute=0, second=0, microsecond=0)
-            query = query.filter(Equipment.timestamp >= start_time)
+    return params
 
-        elif 'last_month' in filter_by:
-            start_time = now - timedelta(days=30)
-            start_time = start_time.replace(
-                hour=0, minute=0, second=0, microsecond=0)
-            query = query.filter(Equipment.timestamp >= start_time)
 
-    if timestamp:
-        query = query.filter(Equipment.timestamp == timestamp)
+@lru_cache(maxsize=16)
+def get_listing_conditions(filters: tuple[str, ...],
+                           model: type[Equipment] | type[EquipmentReading] = Equipment) -> tuple:
+    conditions = []
 
-    if value:
-        query = query.filter(Equipment.value == value)
+    if 'equipment_id' in filters:
+        conditions += [Equipment.equipmentId == bindparam('equipment_id'),
+                       model.value != None]
 
-    return query
+    if 'start_time' in filters:
+        conditions.append(model.timestamp >= bindparam('start_time'))
+
+    if 'timestamp' in filters:
+        conditions.append(model.timestamp == bindparam('timestamp'))
+
+    if 'value' in filters:
+        conditions.append(model.value == bindparam('value'))
+
+    return tuple(conditions)
+
+
+def add_query_filters(query: BaseQuery, filter_by: list) -> BaseQuery:
+    params = get_listing_params(filter_by)
+    return query.filter(*get_listing_conditions(tuple(params))).params(**params)
@@ -1,3 +1,56 @@
+from src.routers.helpers.admission import admission_controlled, admission_controller, get_overload_response, is_overload_error
 from src.routers.helpers.authenticate import token_required
-from src.routers.helpers.responser import get_response
-from src.routers.helpers.session_configuration import configure_session, get_engine
+from src.routers.helpers.read_replica import get_read_target, mark_primary_write, read_from_replica
+from src.routers.helpers.responser import EncodedJson, get_encoded_response, get_response
+from src.routers.helpers.session_configuration import configure_pooled_session, configure_session, get_engine, get_pooled_engine
+from src.routers.helpers.change_feed import CHANGE_FIELDS, MAX_CHANGES_LIMIT, get_changes_since, get_last_change_seq, get_safe_change_seq
+from src.routers.helpers.devices import backfill_devices, escape_like, record_devices, search_devices
+from src.routers.helpers.facets import FACET_ORDERS, MAX_FACET_LIMIT, VersionedCache, facet_cache, get_data_version, get_facets
+from src.routers.helpers.live_stream import ReadingsListener, notify_readings, open_stream, readings_listener, stream_readings
+from src.routers.helpers.reading_hooks import on_readings_written
+from src.routers.helpers.profiling import request_profiler
+from src.routers.helpers.single_flight import SingleFlight
+from src.routers.helpers.summary import rebuild_summary, record_summary
+from src.routers.helpers.storage_migration import migrate_storage
+from src.routers.helpers.stats import MAX_STATS_EQUIPMENTS, get_stats, query_stats, stats_cache
+from src.routers.helpers.upload_ingest import (
+    UPLOAD_COLUMNS,
+    UPLOAD_DTYPES,
+    get_upload_chunk_rows,
+    get_upload_workers,
+    ingest_partitions,
+    normalize_rows,
+    normalize_timestamp,
+    partition_rows,
+    standardize_equipment_id,
+    standardize_timestamp,
+    upload_executors,
+    upsert_readings
+)
+from src.routers.helpers.upload_meter import UploadMeter, get_rss_bytes
+from src.routers.helpers.upload_source import HashingStream, get_upload_stream, hash_stream, iter_csv_streams
+from src.routers.helpers.upload_ledger import (
+    APPLIED,
+    FAILED,
+    find_applied_upload,
+    hash_chunk,
+    is_chunk_applied,
+    record_chunk,
+    record_upload
+)
+from src.routers.helpers.retention import (
+    RetentionPolicy,
+    compact_readings,
+    get_policy,
+    get_rollup_rows_query,
+    get_rollup_totals,
+    is_compacted
+)
+from src.routers.helpers.write_buffer import (
+    ACK_ON_ENQUEUE,
+    ACK_ON_FLUSH,
+    WriteBuffer,
+    get_write_buffer,
+    get_write_buffer_ack,
+    is_write_buffer_enabled
+)
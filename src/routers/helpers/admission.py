@@ -0,0 +1,198 @@
+from functools import wraps
+from http import HTTPStatus
+from threading import BoundedSemaphore, Lock
+from time import monotonic, time
+from typing import Callable
+
+from flask import Flask, Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+
+from src.helpers import ContextHelper, EnvVarsTranslater, metrics
+from src.logs import logger
+from src.routers.helpers.responser import get_response
+
+# name: (concurrent requests per worker given its thread count, deadline in seconds)
+DEFAULT_POOLS = {
+    'default': (lambda threads: threads, 30),
+    'heavy': (lambda threads: max(threads - 1, 1), 60),
+    'upload': (lambda threads: 1, 240),
+}
+
+# SQLSTATE of a statement cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+
+
+def get_worker_threads() -> int:
+    """Requests a worker runs at once: uWSGI's `threads`, or WORKER_THREADS outside of it."""
+    if ContextHelper.is_running_inside_wsgi():
+        import uwsgi
+        threads = uwsgi.opt.get('threads', 1)
+        if isinstance(threads, list):
+            threads = threads[-1]
+        return max(int(threads), 1)
+
+    return max(EnvVarsTranslater.get_int('WORKER_THREADS', default=2), 1)
+
+
+class AdmissionPool():
+    def __init__(self, name: str, concurrency: int, deadline_seconds: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.deadline_seconds = deadline_seconds
+        self._slots = BoundedSemaphore(concurrency)
+
+    def acquire(self, timeout: float) -> bool:
+        return self._slots.acquire(timeout=timeout)
+
+    def release(self):
+        self._slots.release()
+
+
+class AdmissionController():
+    """
+    Limits how many requests of each kind a worker runs at once and sheds
+    the excess with a 503 instead of letting it queue until harakiri.
+
+    A request is shed when it already waited more than `max_queue_age`
+    seconds before reaching the worker (from the X-Request-Start header
+    nginx adds), or when no slot of its pool frees up within
+    `queue_seconds`. Pool sizes follow the worker's thread count, with
+    `heavy` below it, since a pool as large as the worker never fills.
+    Admitted requests get a deadline, applied to every transaction they
+    open as statement_timeout, so runaway queries are cancelled by Postgres.
+    """
+
+    def __init__(self):
+        self.queue_seconds = 2.0
+        self.max_queue_age = 10.0
+        self.retry_after = 5
+        self.threads = 2
+        self._pools: dict[str, AdmissionPool] = {}
+        self._lock = Lock()
+
+    def init_app(self, app: Flask):
+        self.queue_seconds = EnvVarsTranslater.get_int(
+            'ADMISSION_QUEUE_MS', default=2000) / 1000
+        self.max_queue_age = EnvVarsTranslater.get_int(
+            'ADMISSION_MAX_QUEUE_AGE_MS', default=10000) / 1000
+        self.retry_after = EnvVarsTranslater.get_int(
+            'ADMISSION_RETRY_AFTER', default=5)
+        self.threads = get_worker_threads()
+        self._pools = {}
+
+        app.register_error_handler(PoolTimeoutError, self.get_overload_response)
+
+    def get_pool(self, name: str) -> AdmissionPool:
+        with self._lock:
+            if name not in self._pools:
+                concurrency, deadline_seconds = DEFAULT_POOLS[name]
+                self._pools[name] = AdmissionPool(
+                    name,
+                    EnvVarsTranslater.get_int(
+                        f'ADMISSION_{name.upper()}_CONCURRENCY', default=concurrency(self.threads)),
+                    EnvVarsTranslater.get_int(
+                        f'ADMISSION_{name.upper()}_DEADLINE_SECONDS', default=deadline_seconds)
+                )
+            return self._pools[name]
+
+    def get_queue_age(self) -> float:
+        """Seconds the request waited in nginx and the uWSGI listen queue."""
+        request_start = request.headers.get('X-Request-Start', '')
+        try:
+            return max(time() - float(request_start.removeprefix('t=')), 0)
+        except ValueError:
+            return 0
+
+    def shed(self, pool_name: str, reason: str):
+        metrics.increment(f'admission.shed.{pool_name}')
+        logger.warning(f'Shedding {request.method} {request.full_path}: {reason}')
+
+        response = get_response(HTTPStatus.SERVICE_UNAVAILABLE,
+                                'The server is busy, please retry in a few seconds')
+        response.headers['Retry-After'] = str(self.retry_after)
+        return response
+
+    def get_overload_response(self, ex: BaseException) -> Response | None:
+        """
+        The 503 for a request the database had no room for: it waited more
+        than DB_POOL_TIMEOUT for a connection, or Postgres cancelled its
+        query at the request deadline. None for any other error.
+        """
+        if isinstance(ex, PoolTimeoutError):
+            metrics.increment('admission.shed.db_pool')
+            logger.warning(f'Database pool wait exceeded its budget: {ex}')
+        elif is_query_canceled(ex):
+            metrics.increment('admission.deadline_exceeded')
+            logger.warning(f'Query cancelled at the request deadline: {request.method} {request.full_path}')
+        else:
+            return None
+
+        response = get_response(HTTPStatus.SERVICE_UNAVAILABLE,
+                                'The server is busy, please retry in a few seconds')
+        response.headers['Retry-After'] = str(self.retry_after)
+        return response
+
+    def run(self, pool_name: str, f: Callable, *args, **kwargs):
+        pool = self.get_pool(pool_name)
+
+        queue_age = self.get_queue_age()
+        if queue_age > self.max_queue_age:
+            return self.shed(pool_name, f'it waited {queue_age:.1f}s before reaching the worker')
+
+        waiting_since = monotonic()
+        if not pool.acquire(timeout=self.queue_seconds):
+            return self.shed(pool_name, f'no {pool_name} slot freed up in {self.queue_seconds}s')
+
+        metrics.observe(f'admission.queue.{pool_name}', monotonic() - waiting_since)
+
+        try:
+            g.deadline = monotonic() + pool.deadline_seconds
+            return f(*args, **kwargs)
+        finally:
+            pool.release()
+
+
+admission_controller = AdmissionController()
+
+
+def is_query_canceled(ex: BaseException) -> bool:
+    return getattr(getattr(ex, 'orig', None), 'pgcode', None) == QUERY_CANCELED
+
+
+def is_overload_error(ex: BaseException) -> bool:
+    """Errors answered with a 503 by get_overload_response, that routes let through."""
+    return isinstance(ex, PoolTimeoutError) or is_query_canceled(ex)
+
+
+def get_overload_response(ex: BaseException) -> Response | None:
+    return admission_controller.get_overload_response(ex)
+
+
+def admission_controlled(pool: str | Callable[[], str] = 'default'):
+    """Runs the route inside an admission pool, given by name or chosen per request."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            pool_name = pool() if callable(pool) else pool
+            return admission_controller.run(pool_name, f, *args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+@event.listens_for(Session, 'after_begin')
+def apply_request_deadline(session, transaction, connection):
+    if not has_request_context() or g.get('deadline') is None:
+        return
+
+    if connection.dialect.driver != 'psycopg2':
+        return
+
+    remaining_ms = max(int((g.deadline - monotonic()) * 1000), 1)
+
+    # SET LOCAL only lasts until the transaction ends, so it is applied
+    # again to every transaction the request opens, not once per checkout
+    connection.exec_driver_sql(f'SET LOCAL statement_timeout = {remaining_ms}')
@@ -3,7 +3,7 @@ from functools import wraps
 from http import HTTPStatus
 
 import jwt
-from flask import request
+from flask import g, request
 
 from src.routers.helpers.responser import get_response
 from src.logs import logger
@@ -17,6 +17,7 @@ def token_required(f):
         token = read_token()
         if type(token) is not dict:
             return token
+        g.token_data = token
         return f(*args, **kwargs)
 
     return decorated
@@ -0,0 +1,61 @@
+from itertools import takewhile
+
+from sqlalchemy import select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from src.models import Equipment, get_row_encoder
+
+CHANGE_FIELDS = ('change_seq', 'equipmentId', 'timestamp', 'value')
+MAX_CHANGES_LIMIT = 10000
+
+OLDEST_RUNNING_TRANSACTION_ID = text(
+    'SELECT (pg_snapshot_xmin(pg_current_snapshot())::text)::bigint')
+
+
+def get_last_change_seq(connection: Connection | Session) -> int:
+    return connection.execute(text(
+        'SELECT COALESCE(MAX(change_seq), 0) FROM equipment')).scalar()
+
+
+def get_safe_change_seq(connection: Connection | Session) -> int:
+    """
+    The highest change sequence a new consumer can start after without
+    missing readings that are still being written: rows of transactions
+    younger than the oldest one still running are held back, as in
+    get_changes_since, and read once that transaction ends.
+    """
+    return connection.execute(text(
+        'SELECT COALESCE(MAX(change_seq), 0) FROM equipment '
+        'WHERE change_xid < (pg_snapshot_xmin(pg_current_snapshot())::text)::bigint')).scalar()
+
+
+def get_changes_since(connection: Connection | Session,
+                      since: int,
+                      limit: int,
+                      equipment_ids: set[str] | None = None) -> list[tuple]:
+    """
+    Readings inserted or updated after the `since` change sequence, as
+    (change_seq, equipmentId, timestamp, value) tuples in sequence order.
+
+    A row takes its sequence when it is written but only shows up when its
+    transaction commits, so a long upload can commit lower sequences after
+    a POST already committed a higher one. Rows written by transactions
+    younger than the oldest one still running are held back until it ends,
+    so a consumer moving its cursor forward never skips a change.
+    """
+    oldest_running_xid = connection.execute(
+        OLDEST_RUNNING_TRANSACTION_ID).scalar()
+
+    query = select(Equipment.change_xid, *get_row_encoder(CHANGE_FIELDS).columns) \
+        .where(Equipment.change_seq > since) \
+        .order_by(Equipment.change_seq) \
+        .limit(limit)
+
+    if equipment_ids:
+        query = query.where(Equipment.equipmentId.in_(equipment_ids))
+
+    rows = connection.execute(query).all()
+
+    return [tuple(columns) for _, *columns in
+            takewhile(lambda row: row.change_xid < oldest_running_xid, rows)]
@@ -0,0 +1,123 @@
+from contextlib import closing
+from datetime import timedelta
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.models import EquipmentDevice
+from src.routers.helpers.session_configuration import configure_pooled_session
+
+# last_seen is only moved when it is this far behind, so devices posting
+# every second don't update their row on every reading
+LAST_SEEN_RESOLUTION = timedelta(minutes=1)
+
+BACKFILL_DEVICES_SQL = """
+INSERT INTO equipment_device ("equipmentId", first_seen, last_seen)
+SELECT d."equipmentId", min(e.timestamp), max(e.timestamp)
+FROM equipment e
+JOIN equipment_device d ON d.id = e.device_key
+GROUP BY d."equipmentId"
+ON CONFLICT ("equipmentId") DO UPDATE SET
+    first_seen = LEAST(equipment_device.first_seen, excluded.first_seen),
+    last_seen = GREATEST(equipment_device.last_seen, excluded.last_seen)
+"""
+
+
+def record_devices(session: Session, rows: list[dict]) -> dict[str, int]:
+    """
+    Creates the equipment_device rows of new equipments, moves first_seen
+    and last_seen of the known ones and returns the device key of every
+    equipmentId in `rows`.
+
+    The devices are only read in the caller's transaction. New ones, and
+    known ones whose seen range has to move, are upserted in a short
+    transaction of their own, so writers of the same equipments never
+    wait on each other's transactions for the device rows. The range may
+    therefore also cover readings whose transaction is rolled back;
+    `sync-devices` realigns it.
+    """
+    seen: dict[str, tuple] = {}
+
+    for row in rows:
+        equipment_id, timestamp = row['equipmentId'], row['timestamp']
+        first_seen, last_seen = seen.get(equipment_id, (timestamp, timestamp))
+        seen[equipment_id] = (min(first_seen, timestamp), max(last_seen, timestamp))
+
+    if not seen:
+        return {}
+
+    device = EquipmentDevice.__table__
+    device_keys, stale = {}, {}
+
+    for equipment_id, device_key, first_seen, last_seen in session.execute(
+            select(device.c.equipmentId, device.c.id, device.c.first_seen, device.c.last_seen)
+            .where(device.c.equipmentId.in_(list(seen)))):
+        device_keys[equipment_id] = device_key
+        seen_first, seen_last = seen[equipment_id]
+        if seen_first < first_seen or seen_last > last_seen + LAST_SEEN_RESOLUTION:
+            stale[equipment_id] = seen[equipment_id]
+
+    stale.update({equipment_id: seen[equipment_id]
+                  for equipment_id in seen if equipment_id not in device_keys})
+    if stale:
+        device_keys.update(upsert_devices(stale))
+
+    return device_keys
+
+
+def upsert_devices(seen: dict[str, tuple]) -> dict[str, int]:
+    device = EquipmentDevice.__table__
+    statement = insert(device).values([
+        {'equipmentId': equipment_id, 'first_seen': first_seen, 'last_seen': last_seen}
+        # always in the same order, so concurrent upserts can't deadlock
+        for equipment_id, (first_seen, last_seen) in sorted(seen.items())
+    ])
+    statement = statement.on_conflict_do_update(
+        index_elements=[device.c.equipmentId],
+        set_={'first_seen': func.least(device.c.first_seen, statement.excluded.first_seen),
+              'last_seen': func.greatest(device.c.last_seen, statement.excluded.last_seen)},
+    ).returning(device.c.equipmentId, device.c.id)
+
+    with closing(configure_pooled_session()) as session:
+        try:
+            device_keys = dict(session.execute(statement).all())
+            session.commit()
+            return device_keys
+        except Exception:
+            session.rollback()
+            raise
+
+
+def backfill_devices(session: Session) -> int:
+    """Realigns first_seen and last_seen of every device with its stored readings."""
+    return session.execute(text(BACKFILL_DEVICES_SQL)).rowcount
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_devices(session: Session, q: str, limit: int) -> list[str]:
+    """
+    Equipment ids starting with `q`, most recently seen first, followed by
+    the ones containing it. Both are served by the equipment_device
+    indexes, never by the readings table.
+    """
+    pattern = escape_like(q.lower())
+
+    matches = session.query(EquipmentDevice.equipmentId) \
+        .filter(func.lower(EquipmentDevice.equipmentId).like(f'{pattern}%')) \
+        .order_by(EquipmentDevice.last_seen.desc(), EquipmentDevice.equipmentId) \
+        .limit(limit) \
+        .all()
+
+    if len(matches) < limit and q:
+        matches += session.query(EquipmentDevice.equipmentId) \
+            .filter(EquipmentDevice.equipmentId.ilike(f'%{pattern}%'),
+                    ~func.lower(EquipmentDevice.equipmentId).like(f'{pattern}%')) \
+            .order_by(EquipmentDevice.last_seen.desc(), EquipmentDevice.equipmentId) \
+            .limit(limit - len(matches)) \
+            .all()
+
+    return [equipment_id for equipment_id, in matches]
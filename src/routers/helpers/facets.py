@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Callable
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from src.helpers import EnvVarsTranslater, metrics
+from src.models import Equipment, EquipmentReading, EquipmentSchema
+from src.routers.helpers.single_flight import SingleFlight
+
+FACET_COLUMNS = EquipmentSchema.Meta.fields
+FACET_ORDERS = ('value', '-value', 'count')
+MAX_FACET_LIMIT = 10000
+
+
+class VersionedCache():
+    """
+    Keeps computed results together with the data version they were
+    computed at; a result is only served while the version is unchanged
+    and it is younger than `ttl` seconds. Concurrent misses of the same
+    key and version share one computation.
+
+    Results younger than `fresh_seconds` are served without looking at
+    the version at all, so under steady writes, which move the version
+    every time, a result is recomputed at most once per `fresh_seconds`
+    and the hits don't pay for reading the version. `version` can be a
+    callable, which is then only called when the version is needed.
+    """
+
+    def __init__(self,
+                 max_entries: int = 256,
+                 ttl: int = 300,
+                 name: str = 'cache',
+                 fresh_seconds: float = 0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fresh_seconds = fresh_seconds
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+        self._flights = SingleFlight(name)
+
+    def get(self, key, version, compute: Callable):
+        with self._lock:
+            entry = self._entries.get(key)
+            age = monotonic() - entry[1] if entry else None
+
+        if entry and age < self.fresh_seconds:
+            return self.hit(key, entry)
+
+        if callable(version):
+            version = version()
+
+        if entry and entry[0] == version and age < self.ttl:
+            return self.hit(key, entry)
+
+        metrics.increment('equipment.cache.misses')
+        value = self._flights.do((key, version), compute)
+
+        with self._lock:
+            self._entries[key] = (version, monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return value
+
+    def hit(self, key, entry: tuple):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+        metrics.increment('equipment.cache.hits')
+        return entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+facet_cache = VersionedCache(
+    ttl=EnvVarsTranslater.get_int('FACET_CACHE_TTL', default=300),
+    name='facets',
+    fresh_seconds=EnvVarsTranslater.get_int('FACET_CACHE_FRESH_SECONDS', default=10))
+
+
+def get_data_version(session: Session) -> int:
+    """Moves forward on every insert or update, read from the change_seq index."""
+    return session.query(func.coalesce(func.max(EquipmentReading.change_seq), 0)).scalar()
+
+
+def query_facets(session: Session,
+                 column_name: str,
+                 order: str = 'value',
+                 limit: int | None = None) -> list[tuple]:
+    if column_name not in FACET_COLUMNS:
+        raise ValueError(f"Unknown column_name '{column_name}'")
+
+    # only equipmentId needs the join to equipment_device
+    column = getattr(Equipment if column_name == 'equipmentId' else EquipmentReading, column_name)
+    count = func.count().label('count')
+
+    order_by = {
+        'value': column.asc(),
+        '-value': column.desc(),
+        'count': count.desc(),
+    }[order]
+
+    query = session.query(column, count) \
+        .filter(column != None) \
+        .group_by(column) \
+        .order_by(order_by, column.asc())
+
+    if limit:
+        query = query.limit(limit)
+
+    return [tuple(row) for row in query.all()]
+
+
+def get_facets(session: Session,
+               column_name: str,
+               order: str = 'value',
+               limit: int | None = None) -> list[tuple]:
+    """
+    Distinct (value, count) pairs of a column, computed in SQL and cached
+    until the next write, at least for FACET_CACHE_FRESH_SECONDS; deletes
+    made by the retention compaction don't move the data version and are
+    picked up after FACET_CACHE_TTL. Ordered by timestamp, only the first
+    `limit` entries of the timestamp index are read.
+    """
+    return facet_cache.get((column_name, order, limit),
+                           lambda: get_data_version(session),
+                           lambda: query_facets(session, column_name, order, limit))
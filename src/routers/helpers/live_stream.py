@@ -0,0 +1,233 @@
+import json
+import os
+from functools import lru_cache
+from http import HTTPStatus
+from select import select
+from threading import BoundedSemaphore, Event, Lock, Thread
+from time import monotonic, sleep
+from typing import Iterator
+
+from flask import Response, stream_with_context
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from src.helpers import EnvVarsTranslater, metrics
+from src.logs import logger
+from src.models import get_row_encoder
+from src.routers.helpers.change_feed import get_changes_since, get_safe_change_seq
+from src.routers.helpers.responser import get_response
+from src.routers.helpers.session_configuration import get_engine, get_pooled_engine
+
+READINGS_CHANNEL = 'equipment_readings'
+ALL_EQUIPMENTS = '*'
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_SIZE = 7500
+STREAM_BATCH_SIZE = 500
+
+
+def notify_readings(session: Session, equipment_ids) -> None:
+    """
+    Tells the live streams which equipments got new readings.
+
+    The notification is queued in the current transaction, so listeners
+    only hear about it once the readings are committed.
+    """
+    payload = json.dumps(sorted(set(equipment_ids)))
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        payload = json.dumps(ALL_EQUIPMENTS)
+
+    session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                    {'channel': READINGS_CHANNEL, 'payload': payload})
+
+
+class Subscription():
+    def __init__(self, equipment_ids: set[str]):
+        self.equipment_ids = equipment_ids
+        self._changed = Event()
+
+    def notify(self, equipment_ids: set[str] | str):
+        if equipment_ids == ALL_EQUIPMENTS or self.equipment_ids & equipment_ids:
+            self._changed.set()
+
+    def wait(self, timeout: float) -> bool:
+        changed = self._changed.wait(timeout)
+        self._changed.clear()
+        return changed
+
+
+class ReadingsListener():
+    """
+    Holds one LISTEN connection per worker and wakes up the streams whose
+    equipments got new readings, so idle streams never query the database.
+
+    Notifications are sent by every worker, so a reading committed by any
+    of them reaches the streams of all of them.
+    """
+
+    def __init__(self, poll_seconds: float = 5):
+        self.poll_seconds = poll_seconds
+        self._subscriptions: set[Subscription] = set()
+        self._lock = Lock()
+        self._thread: Thread | None = None
+        self._pid = None
+
+    def subscribe(self, equipment_ids: set[str]) -> Subscription:
+        subscription = Subscription(equipment_ids)
+
+        with self._lock:
+            self._ensure_started()
+            self._subscriptions.add(subscription)
+
+        metrics.increment('equipment.stream.subscriptions')
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def dispatch(self, payload: str):
+        equipment_ids = json.loads(payload)
+        if equipment_ids != ALL_EQUIPMENTS:
+            equipment_ids = set(equipment_ids)
+
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+
+        for subscription in subscriptions:
+            subscription.notify(equipment_ids)
+
+    def wake_all(self):
+        self.dispatch(json.dumps(ALL_EQUIPMENTS))
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        self._pid = os.getpid()
+        self._thread = Thread(target=self._run,
+                              name='equipment-readings-listener', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception as ex:
+                logger.warning(f'Lost the {READINGS_CHANNEL} listener: {ex}')
+                # readings may have been missed while reconnecting
+                self.wake_all()
+                sleep(self.poll_seconds)
+
+    def _listen(self):
+        connection = get_engine().raw_connection()
+        try:
+            driver_connection = connection.driver_connection
+            driver_connection.autocommit = True
+            with driver_connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {READINGS_CHANNEL}')
+
+            logger.debug(f'Listening to {READINGS_CHANNEL}')
+
+            while True:
+                if select([driver_connection], [], [], self.poll_seconds) == ([], [], []):
+                    continue
+
+                driver_connection.poll()
+                while driver_connection.notifies:
+                    self.dispatch(driver_connection.notifies.pop(0).payload)
+        finally:
+            connection.close()
+
+
+readings_listener = ReadingsListener()
+
+
+def get_stream_heartbeat_seconds() -> int:
+    return EnvVarsTranslater.get_int('STREAM_HEARTBEAT_SECONDS', default=15)
+
+
+def get_stream_max_seconds() -> int:
+    return EnvVarsTranslater.get_int('STREAM_MAX_SECONDS', default=240)
+
+
+def get_stream_max_per_worker() -> int:
+    return EnvVarsTranslater.get_int('STREAM_MAX_PER_WORKER', default=1)
+
+
+@lru_cache
+def get_stream_slots() -> BoundedSemaphore:
+    return BoundedSemaphore(get_stream_max_per_worker())
+
+
+def open_stream(equipment_ids: set[str], last_event_id: int | None = None) -> Response:
+    """
+    The event stream response, or a 503 when this worker already serves
+    STREAM_MAX_PER_WORKER streams, so streams never take every thread
+    from the other requests. The slot is given back when the response
+    is closed, however the stream ends.
+    """
+    slots = get_stream_slots()
+    if not slots.acquire(blocking=False):
+        metrics.increment('equipment.stream.rejected')
+        response = get_response(HTTPStatus.SERVICE_UNAVAILABLE,
+                                'Too many open streams, please retry in a few seconds')
+        response.headers['Retry-After'] = str(get_stream_heartbeat_seconds())
+        return response
+
+    response = Response(stream_with_context(stream_readings(equipment_ids, last_event_id)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+    response.call_on_close(slots.release)
+    return response
+
+
+def fetch_readings_since(event_id: int, equipment_ids: set[str]) -> list[tuple]:
+    with get_pooled_engine().connect() as connection:
+        return get_changes_since(connection, event_id, STREAM_BATCH_SIZE, equipment_ids)
+
+
+def format_event(event_id: int, data: str, event: str = 'reading') -> str:
+    return f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+
+
+def stream_readings(equipment_ids: set[str], last_event_id: int | None = None) -> Iterator[str]:
+    """
+    Yields Server-Sent Events with every reading inserted or updated for
+    the equipments after the `last_event_id` change sequence, or after the
+    oldest transaction still running when the stream was opened.
+
+    A comment is sent every STREAM_HEARTBEAT_SECONDS without readings to
+    keep proxies from closing the connection, and the stream ends after
+    STREAM_MAX_SECONDS, before uWSGI's harakiri, so the worker thread is
+    given back; browsers reconnect on their own and resume from the
+    Last-Event-ID they received.
+    """
+    subscription = readings_listener.subscribe(equipment_ids)
+    encoder = get_row_encoder()
+    heartbeat_seconds = get_stream_heartbeat_seconds()
+    closes_at = monotonic() + get_stream_max_seconds()
+
+    try:
+        if last_event_id is None:
+            with get_pooled_engine().connect() as connection:
+                last_event_id = get_safe_change_seq(connection)
+
+        yield 'retry: 3000\n\n'
+
+        while monotonic() < closes_at:
+            readings = fetch_readings_since(last_event_id, equipment_ids)
+
+            for event_id, *columns in readings:
+                yield format_event(event_id, encoder.encode_row(columns))
+                last_event_id = event_id
+
+            metrics.increment('equipment.stream.events', len(readings))
+
+            if len(readings) == STREAM_BATCH_SIZE:
+                continue
+
+            if not subscription.wait(min(heartbeat_seconds, max(closes_at - monotonic(), 0))):
+                yield ': heartbeat\n\n'
+    finally:
+        readings_listener.unsubscribe(subscription)
@@ -0,0 +1,263 @@
+import cProfile
+import os
+import sys
+from collections import Counter, defaultdict
+from hmac import compare_digest
+from json import dump
+from random import random
+from threading import Event, Lock, Thread, get_ident
+from time import perf_counter, strftime
+from uuid import uuid4
+
+from flask import Flask, Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from src.helpers import EnvVarsTranslater, metrics
+from src.logs import logger
+
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_MODES = ('sample', 'cprofile')
+MAX_PROFILED_QUERIES = 50
+
+# cProfile hooks into sys.monitoring, which is process-wide since Python
+# 3.12, so only one request of the worker can be under cProfile at a time
+CPROFILE_LOCK = Lock()
+
+
+class StackSampler():
+    """
+    Records the stack of one thread every `interval` seconds, as collapsed
+    stacks (`outer;inner count` lines) that flamegraph.pl and speedscope
+    read. Waiting on Postgres shows up as time spent in the driver.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self) -> bool:
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        with open(f'{path}.collapsed', 'w') as output:
+            for stack, count in self.samples.most_common():
+                output.write(f'{stack} {count}\n')
+
+
+class DeterministicProfiler():
+    """
+    cProfile of the request, written as pstats for snakeviz or gprof2dot.
+    It holds CPROFILE_LOCK while enabled and doesn't start when another
+    request already holds it.
+    """
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+        self._enabled = False
+
+    def start(self) -> bool:
+        if not CPROFILE_LOCK.acquire(blocking=False):
+            return False
+
+        try:
+            self._profile.enable()
+        except ValueError:
+            # another profiling tool, such as a debugger or coverage, is active
+            CPROFILE_LOCK.release()
+            return False
+
+        self._enabled = True
+        return True
+
+    def stop(self):
+        if self._enabled:
+            self._profile.disable()
+            self._enabled = False
+            CPROFILE_LOCK.release()
+
+    def write(self, path: str):
+        self._profile.dump_stats(f'{path}.pstats')
+
+
+class RequestProfile():
+    def __init__(self, profiler: StackSampler | DeterministicProfiler):
+        self.profiler = profiler
+        self.started_at = perf_counter()
+        self.queries: dict[str, list[float]] = defaultdict(list)
+
+    def record_query(self, statement: str, seconds: float):
+        self.queries[statement].append(seconds)
+
+    def get_sql_timing(self) -> dict:
+        queries = sorted(self.queries.items(), key=lambda item: sum(item[1]), reverse=True)
+
+        return {
+            'count': sum(len(durations) for _, durations in queries),
+            'total_ms': round(sum(sum(durations) for _, durations in queries) * 1000, 2),
+            'statements': [{'statement': statement,
+                            'count': len(durations),
+                            'total_ms': round(sum(durations) * 1000, 2),
+                            'max_ms': round(max(durations) * 1000, 2)}
+                           for statement, durations in queries[:MAX_PROFILED_QUERIES]],
+        }
+
+
+class RequestProfiler():
+    """
+    Opt-in profiling of single requests. A request is profiled when it
+    sends PROFILE_TOKEN in the X-Profile-Token header, or at random with
+    PROFILE_SAMPLE_RATE. Each profile is written to PROFILE_DIR, which
+    keeps at most PROFILE_MAX_FILES profiles: the stacks (collapsed or
+    pstats) and a .json with the request and the time of its SQL.
+
+    Nothing is hooked into Flask or SQLAlchemy unless one of the two
+    triggers is configured.
+    """
+
+    def __init__(self):
+        self.token = ''
+        self.sample_rate = 0.0
+        self.mode = 'sample'
+        self.interval = 0.005
+        self.directory = ''
+        self.max_files = 50
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token) or self.sample_rate > 0
+
+    def init_app(self, app: Flask):
+        self.token = os.getenv('PROFILE_TOKEN', '')
+        self.sample_rate = EnvVarsTranslater.get_float('PROFILE_SAMPLE_RATE', default=0.0)
+        self.mode = os.getenv('PROFILE_MODE', 'sample')
+        self.interval = EnvVarsTranslater.get_int('PROFILE_INTERVAL_MS', default=5) / 1000
+        self.directory = os.getenv('PROFILE_DIR', '/tmp/equipments-profiles')
+        self.max_files = EnvVarsTranslater.get_int('PROFILE_MAX_FILES', default=50)
+
+        if self.mode not in PROFILE_MODES:
+            raise ValueError(f"Unsupported PROFILE_MODE '{self.mode}'. Use one of: {
+                             ', '.join(PROFILE_MODES)}")
+
+        if not self.enabled:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self.start)
+        app.after_request(self.stop)
+        app.teardown_request(self.discard)
+
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+    def should_profile(self) -> bool:
+        token = request.headers.get(PROFILE_HEADER)
+        if token and self.token and compare_digest(token, self.token):
+            return True
+
+        return random() < self.sample_rate
+
+    def start(self):
+        if not self.should_profile():
+            return
+
+        if self.mode == 'cprofile':
+            profiler = DeterministicProfiler()
+        else:
+            profiler = StackSampler(get_ident(), self.interval)
+
+        if not profiler.start():
+            metrics.increment('profiler.skipped')
+            return
+
+        g.profile = RequestProfile(profiler)
+
+    def stop(self, response: Response) -> Response:
+        profile: RequestProfile | None = g.pop('profile', None)
+        if profile is None:
+            return response
+
+        profile.profiler.stop()
+        elapsed = perf_counter() - profile.started_at
+
+        name = f"{strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unknown'}-{uuid4().hex[:8]}"
+        path = os.path.join(self.directory, name)
+
+        try:
+            profile.profiler.write(path)
+            with open(f'{path}.json', 'w') as output:
+                dump({'method': request.method,
+                      'url': request.full_path,
+                      'status': response.status_code,
+                      'elapsed_ms': round(elapsed * 1000, 2),
+                      'mode': self.mode,
+                      'sql': profile.get_sql_timing()}, output, indent=2)
+            self.prune()
+        except OSError as ex:
+            logger.warning(f'Unable to write request profile {path}: {ex}')
+            return response
+
+        metrics.increment('profiler.requests')
+        response.headers['X-Profile-Id'] = name
+        return response
+
+    def discard(self, exception: BaseException | None = None):
+        """Stops the profiler of requests that failed before after_request."""
+        profile: RequestProfile | None = g.pop('profile', None)
+        if profile is not None:
+            profile.profiler.stop()
+
+    def prune(self):
+        """Drops the oldest profiles once the spool holds more than `max_files`."""
+        profiles: dict[str, float] = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                name = entry.name.rsplit('.', 1)[0]
+                profiles[name] = max(profiles.get(name, 0), entry.stat().st_mtime)
+
+        oldest_first = sorted(profiles, key=profiles.get)
+        for name in oldest_first[:max(len(oldest_first) - self.max_files, 0)]:
+            for extension in ('collapsed', 'pstats', 'json'):
+                try:
+                    os.remove(os.path.join(self.directory, f'{name}.{extension}'))
+                except FileNotFoundError:
+                    pass
+
+
+request_profiler = RequestProfiler()
+
+
+def get_request_profile() -> RequestProfile | None:
+    return g.get('profile') if has_request_context() else None
+
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if get_request_profile() is not None:
+        connection.info.setdefault('profile_query_start', []).append(perf_counter())
+
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    profile = get_request_profile()
+    if profile is not None and connection.info.get('profile_query_start'):
+        profile.record_query(statement, perf_counter() - connection.info['profile_query_start'].pop())
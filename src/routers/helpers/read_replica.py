@@ -0,0 +1,26 @@
+from functools import wraps
+
+from flask import g
+
+from src.config import replica_router
+
+
+def get_request_user_id():
+    return g.get('token_data', {}).get('id')
+
+
+def get_read_target() -> str:
+    return 'primary' if g.get('read_engine') is None else 'replica'
+
+
+def read_from_replica(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        g.read_engine = replica_router.get_read_engine(get_request_user_id())
+        return f(*args, **kwargs)
+
+    return decorated
+
+
+def mark_primary_write():
+    replica_router.mark_write(get_request_user_id())
@@ -0,0 +1,50 @@
+from contextlib import closing
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, SessionTransaction
+
+from src.helpers import metrics
+from src.logs import logger
+from src.routers.helpers.live_stream import notify_readings
+from src.routers.helpers.session_configuration import configure_pooled_session
+from src.routers.helpers.summary import record_summary
+
+PENDING_SUMMARY = 'pending_summary_rows'
+
+
+def on_readings_written(session: Session, rows: list[dict]) -> None:
+    """
+    Keeps everything derived from the readings in step with them. Every
+    write path must call it, with the equipmentId, timestamp and value of
+    the readings it wrote.
+
+    The live streams are notified inside the transaction that wrote the
+    readings. The summary is folded in right after that transaction
+    commits, in a short one of its own, so a long upload never holds the
+    summary rows of its equipments locked.
+    """
+    session.info.setdefault(PENDING_SUMMARY, []).extend(rows)
+    notify_readings(session, (row['equipmentId'] for row in rows))
+
+
+@event.listens_for(Session, 'after_commit')
+def write_pending_summary(session: Session):
+    rows = session.info.pop(PENDING_SUMMARY, None)
+    if not rows:
+        return
+
+    try:
+        with closing(configure_pooled_session()) as summary_session:
+            record_summary(summary_session, rows)
+            summary_session.commit()
+    except Exception as ex:
+        # the readings are committed already; rebuild-summary repairs it
+        metrics.increment('equipment.summary.failed_rows', len(rows))
+        logger.exception(f'Unable to fold {len(rows)} readings into equipment_summary: {ex}')
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def discard_pending_summary(session: Session, transaction: SessionTransaction):
+    # rolled back, or closed without a commit
+    if transaction.parent is None:
+        session.info.pop(PENDING_SUMMARY, None)
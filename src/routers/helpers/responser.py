@@ -1,6 +1,13 @@
+from json import dumps
+from json.encoder import encode_basestring_ascii
+
 from flask import jsonify, make_response, Response
 
 
+class EncodedJson(str):
+    """A JSON fragment that was already serialized and is written as is."""
+
+
 def get_response(status_code: int, content: str | dict | list = None) -> Response:
     if isinstance(content, str):
         content = {"message": content}
@@ -8,3 +15,22 @@ def get_response(status_code: int, content: str | dict | list = None) -> Respons
         return make_response(content, status_code)
 
     return make_response(jsonify(content), status_code)
+
+
+def encode_value(value) -> str:
+    if isinstance(value, EncodedJson):
+        return value
+    return dumps(value, separators=(',', ':'), sort_keys=True)
+
+
+def get_encoded_response(status_code: int, content: dict) -> Response:
+    """
+    Writes the response body in one pass, with the same compact, key-sorted
+    layout jsonify uses, embedding EncodedJson values without re-parsing them.
+    """
+    body = '{' + ','.join(
+        f'{encode_basestring_ascii(key)}:{encode_value(value)}'
+        for key, value in sorted(content.items())
+    ) + '}\n'
+
+    return Response(body.encode('ascii'), status=status_code, mimetype='application/json')
@@ -0,0 +1,202 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import Float, bindparam, cast, func, select, text
+from sqlalchemy.orm import Query, Session
+
+from src.helpers import EnvVarsTranslater
+from src.logs import logger
+from src.models import EquipmentRollup
+from src.routers.helpers.session_configuration import get_engine
+
+GRANULARITIES = ('hour', 'day')
+
+COMPACT_BATCH_SQL = """
+WITH batch AS (
+    DELETE FROM equipment
+    WHERE ctid = ANY(ARRAY(
+        SELECT ctid FROM equipment
+        WHERE timestamp < :cutoff AND {equipment_filter}
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED))
+    RETURNING device_key, timestamp, value
+), rolled_up AS (
+    INSERT INTO equipment_rollup
+        ("equipmentId", granularity, bucket_start, count, sum, sum_squares, min, max)
+    SELECT d."equipmentId", :granularity, date_trunc(:granularity, batch.timestamp),
+           count(batch.value), sum(batch.value), sum(batch.value * batch.value),
+           min(batch.value), max(batch.value)
+    FROM batch
+    JOIN equipment_device d ON d.id = batch.device_key
+    WHERE batch.value IS NOT NULL
+    GROUP BY 1, 3
+    ON CONFLICT ("equipmentId", granularity, bucket_start) DO UPDATE SET
+        count = equipment_rollup.count + excluded.count,
+        sum = equipment_rollup.sum + excluded.sum,
+        sum_squares = equipment_rollup.sum_squares + excluded.sum_squares,
+        min = LEAST(equipment_rollup.min, excluded.min),
+        max = GREATEST(equipment_rollup.max, excluded.max)
+)
+SELECT count(*) FROM batch
+"""
+
+
+ROLLUP_TOTALS_STATEMENT = select(
+    func.coalesce(func.sum(EquipmentRollup.sum), 0.0),
+    func.coalesce(func.sum(EquipmentRollup.count), 0)
+).where(
+    EquipmentRollup.equipmentId == bindparam('equipment_id'),
+    EquipmentRollup.bucket_start >= bindparam('start_time'),
+    EquipmentRollup.bucket_start <= bindparam('end_time')
+)
+
+
+class RetentionPolicy():
+    def __init__(self, raw_days: int = 0, granularity: str = 'hour'):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unsupported retention granularity '{
+                             granularity}'. Use one of: {', '.join(GRANULARITIES)}")
+
+        self.raw_days = raw_days
+        self.granularity = granularity
+
+    @property
+    def enabled(self) -> bool:
+        return self.raw_days > 0
+
+    def get_cutoff(self, now: datetime | None = None) -> datetime:
+        cutoff = (now or datetime.now()) - timedelta(days=self.raw_days)
+        cutoff = cutoff.replace(minute=0, second=0, microsecond=0)
+
+        if self.granularity == 'day':
+            cutoff = cutoff.replace(hour=0)
+
+        return cutoff
+
+
+def get_default_policy() -> RetentionPolicy:
+    return RetentionPolicy(
+        raw_days=EnvVarsTranslater.get_int('RETENTION_RAW_DAYS', default=0),
+        granularity=os.getenv('RETENTION_GRANULARITY', 'hour').strip().lower()
+    )
+
+
+def get_policy_overrides() -> dict[str, RetentionPolicy]:
+    """Reads RETENTION_OVERRIDES, e.g. 'EQ-1:90:day,EQ-2:7'."""
+    overrides = {}
+
+    for override in os.getenv('RETENTION_OVERRIDES', '').split(','):
+        if not override.strip():
+            continue
+
+        equipment_id, raw_days, *granularity = override.strip().split(':')
+        overrides[equipment_id.strip()] = RetentionPolicy(
+            raw_days=int(raw_days),
+            granularity=granularity[0].strip().lower() if granularity else 'hour'
+        )
+
+    return overrides
+
+
+def get_policy(equipment_id: str) -> RetentionPolicy:
+    return get_policy_overrides().get(equipment_id, get_default_policy())
+
+
+def is_compacted(equipment_id: str, start_time: datetime | None) -> bool:
+    """Whether readings of the equipment since start_time may have been moved to the rollup tier."""
+    policy = get_policy(equipment_id)
+    return policy.enabled and (start_time is None or start_time < policy.get_cutoff())
+
+
+def compact_readings(equipment_id: str | None = None, batch_size: int | None = None) -> int:
+    """
+    Moves raw readings older than their retention window into hourly or
+    daily rollups.
+
+    Every batch deletes at most `batch_size` raw rows and merges them into
+    equipment_rollup in the same short transaction, so readers never see a
+    reading twice or lose one, and no lock is held for long. Rows locked by
+    a concurrent writer are skipped and picked up by the next run.
+    """
+    batch_size = batch_size or EnvVarsTranslater.get_int(
+        'RETENTION_BATCH_SIZE', default=5000)
+    overrides = get_policy_overrides()
+
+    if equipment_id:
+        jobs = [(equipment_id, get_policy(equipment_id))]
+    else:
+        jobs = [(None, get_default_policy()), *overrides.items()]
+
+    engine = get_engine()
+    compacted_rows = 0
+
+    for job_equipment_id, policy in jobs:
+        if not policy.enabled:
+            continue
+
+        if job_equipment_id:
+            equipment_filter = ('device_key IN (SELECT id FROM equipment_device '
+                                'WHERE "equipmentId" = :equipment_id)')
+        else:
+            equipment_filter = ('device_key NOT IN (SELECT id FROM equipment_device '
+                                'WHERE "equipmentId" = ANY(CAST(:excluded_ids AS varchar[])))')
+
+        statement = text(COMPACT_BATCH_SQL.format(
+            equipment_filter=equipment_filter))
+        params = {
+            'cutoff': policy.get_cutoff(),
+            'granularity': policy.granularity,
+            'batch_size': batch_size,
+            'equipment_id': job_equipment_id,
+            'excluded_ids': list(overrides),
+        }
+
+        while True:
+            with engine.begin() as connection:
+                batch_rows = connection.execute(statement, params).scalar()
+
+            compacted_rows += batch_rows
+            if batch_rows < batch_size:
+                break
+
+        logger.info(f"Compacted raw readings older than {params['cutoff']} into {
+                    policy.granularity} rollups for {job_equipment_id or 'all equipments'}")
+
+    return compacted_rows
+
+
+def get_rollup_totals(session: Session,
+                      equipment_id: str,
+                      start_time: datetime,
+                      end_time: datetime) -> tuple[float, int]:
+    total, count = session.execute(ROLLUP_TOTALS_STATEMENT, {
+        'equipment_id': equipment_id,
+        'start_time': start_time,
+        'end_time': end_time,
+    }).one()
+
+    return float(total), int(count)
+
+
+def get_rollup_rows_query(session: Session,
+                          fields: tuple[str, ...],
+                          equipment_id: str,
+                          start_time: datetime | None = None) -> Query:
+    """Rollup buckets shaped as (equipmentId, timestamp, value) readings, one per bucket."""
+    columns = {
+        'equipmentId': EquipmentRollup.equipmentId,
+        'timestamp': EquipmentRollup.bucket_start,
+        'value': EquipmentRollup.sum / cast(EquipmentRollup.count, Float),
+    }
+
+    query = session.query(
+        *[columns[field].label(field) for field in fields]
+    ).filter(
+        EquipmentRollup.equipmentId == equipment_id,
+        EquipmentRollup.count > 0
+    )
+
+    if start_time is not None:
+        query = query.filter(EquipmentRollup.bucket_start >= start_time)
+
+    return query
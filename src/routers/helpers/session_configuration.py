@@ -1,6 +1,10 @@
+from functools import lru_cache
+
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, Session
 
 from src.config import Db_config
+from src.helpers import EnvVarsTranslater
 
 
 def configure_session() -> Session:
@@ -12,5 +16,20 @@ def configure_session() -> Session:
     return session
 
 
+def configure_pooled_session() -> Session:
+    Session = sessionmaker(bind=get_pooled_engine())
+    session = Session()
+    session.begin()
+
+    return session
+
+
 def get_engine() -> Session:
     return Db_config.create_default_db_engine()
+
+
+@lru_cache(maxsize=1)
+def get_pooled_engine() -> Engine:
+    return Db_config.create_pooled_db_engine(
+        pool_size=EnvVarsTranslater.get_int('DB_POOL_SIZE', default=8),
+        pool_timeout=EnvVarsTranslater.get_int('DB_POOL_TIMEOUT', default=5))
@@ -0,0 +1,103 @@
+from datetime import datetime
+from hashlib import sha256
+from threading import Event, Lock
+from typing import Callable
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from src.helpers import metrics
+from src.models import QueryResult
+from src.routers.helpers.session_configuration import get_pooled_engine
+
+
+class InFlightCall():
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight():
+    """
+    Runs at most one computation per key at a time: callers arriving while
+    it runs wait for it and get the same result, or the same exception.
+    Nothing is kept once it finishes, the next caller computes again.
+
+    With `across_workers`, the computation is also serialized between
+    uWSGI workers by a Postgres advisory lock, released as soon as its
+    result (which must be JSON serializable) is left in query_result for
+    the callers of the other workers that were waiting on the lock.
+    """
+
+    def __init__(self, name: str, across_workers: bool = False):
+        self.name = name
+        self.across_workers = across_workers
+        self._calls: dict = {}
+        self._lock = Lock()
+
+    def do(self, key, compute: Callable):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = InFlightCall()
+
+        if not is_leader:
+            metrics.increment(f'coalesced.{self.name}')
+            return call.wait()
+
+        try:
+            call.result = self.run_shared(key, compute) if self.across_workers else compute()
+            return call.result
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def run_shared(self, key, compute: Callable):
+        arrived_at = datetime.now()
+        digest = sha256(repr((self.name, key)).encode()).digest()
+        result_key = digest.hex()
+        lock_id = int.from_bytes(digest[:8], 'big', signed=True)
+
+        # a session-level lock on an autocommit connection, so no transaction
+        # is left open while the result is computed on the request's session
+        with get_pooled_engine().connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT')
+            connection.execute(text('SELECT pg_advisory_lock(:lock_id)'), {'lock_id': lock_id})
+            try:
+                result = connection.execute(
+                    select(QueryResult.value)
+                    .where(QueryResult.key == result_key, QueryResult.created_at >= arrived_at)
+                ).scalar()
+                if result is not None:
+                    metrics.increment(f'coalesced.{self.name}')
+                    return result
+
+                result = compute()
+
+                statement = insert(QueryResult).values(
+                    key=result_key, value=result, created_at=datetime.now())
+                connection.execute(statement.on_conflict_do_update(
+                    index_elements=[QueryResult.key],
+                    set_={'value': statement.excluded.value,
+                          'created_at': statement.excluded.created_at}))
+
+                return result
+            finally:
+                try:
+                    connection.execute(text('SELECT pg_advisory_unlock(:lock_id)'), {'lock_id': lock_id})
+                except Exception:
+                    # closing the database connection is the only other way to release it
+                    connection.invalidate()
+                    raise
@@ -0,0 +1,134 @@
+from datetime import datetime
+from math import sqrt
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from src.helpers import EnvVarsTranslater
+from src.routers.helpers.facets import VersionedCache, get_data_version
+
+MAX_STATS_EQUIPMENTS = 500
+
+RAW_STATS_SQL = """
+SELECT d."equipmentId", w.name,
+       count(e.value), sum(e.value), sum(e.value * e.value), min(e.value), max(e.value)
+       {percentiles}
+FROM equipment_device d
+JOIN equipment e ON e.device_key = d.id
+JOIN unnest(CAST(:window_names AS text[]),
+            CAST(:window_starts AS timestamp[]),
+            CAST(:window_ends AS timestamp[])) AS w(name, start_time, end_time)
+  ON e.timestamp >= w.start_time AND e.timestamp <= w.end_time
+WHERE d."equipmentId" = ANY(CAST(:equipment_ids AS varchar[])) AND e.value IS NOT NULL
+GROUP BY d."equipmentId", w.name
+"""
+
+PERCENTILES_SQL = ', percentile_cont(CAST(:fractions AS float8[])) WITHIN GROUP (ORDER BY e.value)'
+
+ROLLUP_STATS_SQL = """
+SELECT r."equipmentId", w.name,
+       sum(r.count), sum(r.sum), sum(r.sum_squares), min(r.min), max(r.max)
+FROM equipment_rollup r
+JOIN unnest(CAST(:window_names AS text[]),
+            CAST(:window_starts AS timestamp[]),
+            CAST(:window_ends AS timestamp[])) AS w(name, start_time, end_time)
+  ON r.bucket_start >= w.start_time AND r.bucket_start <= w.end_time
+WHERE r."equipmentId" = ANY(CAST(:equipment_ids AS varchar[]))
+GROUP BY r."equipmentId", w.name
+"""
+
+stats_cache = VersionedCache(
+    ttl=EnvVarsTranslater.get_int('FACET_CACHE_TTL', default=300),
+    name='stats',
+    fresh_seconds=EnvVarsTranslater.get_int('FACET_CACHE_FRESH_SECONDS', default=10))
+
+
+def merge_totals(totals: dict, key, count, total, squares, minimum, maximum):
+    previous = totals.get(key)
+    if previous is None:
+        totals[key] = [int(count), float(total), float(squares), minimum, maximum]
+        return
+
+    previous[0] += int(count)
+    previous[1] += float(total)
+    previous[2] += float(squares)
+    previous[3] = min(previous[3], minimum)
+    previous[4] = max(previous[4], maximum)
+
+
+def summarize(totals: list | None, percentiles: list[float], values: list | None) -> dict:
+    count, total, squares, minimum, maximum = totals or (0, 0.0, 0.0, None, None)
+
+    stats = {
+        'count': count,
+        'avg': round(total / count, 2) if count else None,
+        'min': minimum,
+        'max': maximum,
+        'stddev': round(sqrt(max(squares - total * total / count, 0) / (count - 1)), 2)
+        if count > 1 else None,
+    }
+
+    if percentiles:
+        values = values or [None] * len(percentiles)
+        stats['percentiles'] = {
+            f'{percentile:g}': round(value, 2) if value is not None else None
+            for percentile, value in zip(percentiles, values)
+        }
+
+    return stats
+
+
+def query_stats(session: Session,
+                equipment_ids: list[str],
+                windows: dict[str, tuple[datetime, datetime]],
+                percentiles: list[float],
+                with_rollups: bool = False) -> dict:
+    params = {
+        'equipment_ids': equipment_ids,
+        'window_names': list(windows),
+        'window_starts': [start for start, _ in windows.values()],
+        'window_ends': [end for _, end in windows.values()],
+        'fractions': [percentile / 100 for percentile in percentiles],
+    }
+
+    totals, percentile_values = {}, {}
+
+    raw_sql = RAW_STATS_SQL.format(percentiles=PERCENTILES_SQL if percentiles else '')
+    for equipment_id, window, *row in session.execute(text(raw_sql), params):
+        merge_totals(totals, (equipment_id, window), *row[:5])
+        if percentiles:
+            percentile_values[(equipment_id, window)] = row[5]
+
+    if with_rollups:
+        for equipment_id, window, *row in session.execute(text(ROLLUP_STATS_SQL), params):
+            merge_totals(totals, (equipment_id, window), *row)
+
+    return {
+        equipment_id: {
+            window: summarize(totals.get((equipment_id, window)), percentiles,
+                              percentile_values.get((equipment_id, window)))
+            for window in windows
+        }
+        for equipment_id in equipment_ids
+    }
+
+
+def get_stats(session: Session,
+              equipment_ids: list[str],
+              windows: dict[str, tuple[datetime, datetime]],
+              percentiles: list[float],
+              with_rollups: bool = False) -> dict:
+    """
+    count, avg, min, max, stddev and percentiles of every equipment in
+    every window, from one grouped query over the readings (plus one over
+    the rollups when part of the windows was compacted). Percentiles only
+    cover raw readings. Cached until the next write, at least for
+    FACET_CACHE_FRESH_SECONDS.
+    """
+    key = (tuple(equipment_ids),
+           tuple((name, start, end) for name, (start, end) in windows.items()),
+           tuple(percentiles),
+           with_rollups)
+
+    return stats_cache.get(key, lambda: get_data_version(session), lambda: query_stats(
+        session, equipment_ids, windows, percentiles, with_rollups))
@@ -0,0 +1,75 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+
+from src.config import db
+
+CHANGE_FEED_SQL = [
+    'CREATE SEQUENCE IF NOT EXISTS equipment_change_seq',
+    """
+    ALTER TABLE equipment
+        ADD COLUMN change_seq bigint NOT NULL DEFAULT nextval('equipment_change_seq') UNIQUE,
+        ADD COLUMN change_xid bigint NOT NULL DEFAULT (pg_current_xact_id()::text)::bigint
+    """,
+]
+
+DEVICE_KEY_SQL = [
+    """
+    INSERT INTO equipment_device ("equipmentId", first_seen, last_seen)
+    SELECT "equipmentId", min(timestamp), max(timestamp) FROM equipment GROUP BY "equipmentId"
+    ON CONFLICT ("equipmentId") DO NOTHING
+    """,
+    """
+    CREATE TABLE equipment_narrow (
+        device_key integer NOT NULL CONSTRAINT equipment_device_key_fkey REFERENCES equipment_device (id),
+        timestamp timestamp NOT NULL,
+        value double precision,
+        change_seq bigint NOT NULL DEFAULT nextval('equipment_change_seq'),
+        change_xid bigint NOT NULL DEFAULT (pg_current_xact_id()::text)::bigint
+    )
+    """,
+    """
+    INSERT INTO equipment_narrow
+    SELECT d.id, e.timestamp, e.value, e.change_seq, e.change_xid
+    FROM equipment e JOIN equipment_device d USING ("equipmentId")
+    ORDER BY d.id, e.timestamp
+    """,
+    'DROP TABLE equipment',
+    'ALTER TABLE equipment_narrow RENAME TO equipment',
+    'ALTER TABLE equipment ADD CONSTRAINT equipment_pkey PRIMARY KEY (device_key, timestamp) INCLUDE (value)',
+    'ALTER TABLE equipment ADD CONSTRAINT equipment_change_seq_key UNIQUE (change_seq)',
+]
+
+TIMESTAMP_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS ix_equipment_timestamp ON equipment (timestamp)'
+
+
+def get_reading_columns(session: Session) -> set[str]:
+    return {column['name'] for column in inspect(session.connection()).get_columns('equipment')}
+
+
+def migrate_storage(session: Session) -> list[str]:
+    """
+    Brings a database created by an older version to the current tables,
+    in the session's transaction, and returns the steps it needed. Tables
+    that don't exist yet are created; a database that is up to date is
+    left alone.
+    """
+    steps = []
+    db.metadata.create_all(session.connection())
+
+    columns = get_reading_columns(session)
+    if 'change_seq' not in columns:
+        steps.append('change feed columns')
+        for statement in CHANGE_FEED_SQL:
+            session.execute(text(statement))
+
+    if 'device_key' not in columns:
+        steps.append('device keys')
+        for statement in DEVICE_KEY_SQL:
+            session.execute(text(statement))
+
+    indexes = {index['name'] for index in inspect(session.connection()).get_indexes('equipment')}
+    if 'ix_equipment_timestamp' not in indexes:
+        steps.append('timestamp index')
+        session.execute(text(TIMESTAMP_INDEX_SQL))
+
+    return steps
@@ -0,0 +1,78 @@
+from sqlalchemy import case, or_, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.models import EquipmentSummary
+
+REBUILD_SUMMARY_SQL = """
+WITH latest AS (
+    SELECT DISTINCT ON (e.device_key) d."equipmentId", e.timestamp, e.value
+    FROM equipment e
+    JOIN equipment_device d ON d.id = e.device_key
+    ORDER BY e.device_key, e.timestamp DESC
+), counts AS (
+    SELECT "equipmentId", sum(count) AS count
+    FROM (SELECT d."equipmentId", count(*) AS count
+          FROM equipment e
+          JOIN equipment_device d ON d.id = e.device_key
+          GROUP BY d."equipmentId"
+          UNION ALL
+          SELECT "equipmentId", sum(count) FROM equipment_rollup GROUP BY "equipmentId") c
+    GROUP BY "equipmentId"
+)
+INSERT INTO equipment_summary ("equipmentId", last_timestamp, last_value, reading_count)
+SELECT counts."equipmentId", latest.timestamp, latest.value, counts.count
+FROM counts
+LEFT JOIN latest ON latest."equipmentId" = counts."equipmentId"
+"""
+
+
+def record_summary(session: Session, rows: list[dict]) -> None:
+    """
+    Folds written readings into equipment_summary. Rows carry `inserted`
+    when they may be updates of readings already counted; readings older
+    than the stored last one only add to the count.
+    """
+    latest: dict[str, tuple] = {}
+
+    for row in rows:
+        equipment_id = row['equipmentId']
+        last_timestamp, last_value, count = latest.get(equipment_id, (None, None, 0))
+        if last_timestamp is None or row['timestamp'] >= last_timestamp:
+            last_timestamp, last_value = row['timestamp'], row['value']
+        latest[equipment_id] = (last_timestamp, last_value, count + int(row.get('inserted', True)))
+
+    if not latest:
+        return
+
+    summary = EquipmentSummary.__table__
+    statement = insert(summary).values([
+        {'equipmentId': equipment_id, 'last_timestamp': last_timestamp,
+         'last_value': last_value, 'reading_count': count}
+        for equipment_id, (last_timestamp, last_value, count) in sorted(latest.items())
+    ])
+    is_newer = or_(summary.c.last_timestamp == None,
+                   statement.excluded.last_timestamp >= summary.c.last_timestamp)
+    statement = statement.on_conflict_do_update(
+        index_elements=[summary.c.equipmentId],
+        set_={'last_timestamp': case((is_newer, statement.excluded.last_timestamp),
+                                     else_=summary.c.last_timestamp),
+              'last_value': case((is_newer, statement.excluded.last_value),
+                                 else_=summary.c.last_value),
+              'reading_count': summary.c.reading_count + statement.excluded.reading_count}
+    )
+
+    session.execute(statement)
+
+
+def rebuild_summary(session: Session) -> int:
+    """
+    Recomputes equipment_summary from the readings and the rollups. The
+    table is locked first, so writes running meanwhile wait and are then
+    folded in on top of the rebuilt rows. Readings committed just before
+    the rebuild whose summary was not folded in yet are counted twice;
+    running it again fixes that.
+    """
+    session.execute(text('LOCK TABLE equipment_summary IN EXCLUSIVE MODE'))
+    session.execute(text('DELETE FROM equipment_summary'))
+    return session.execute(text(REBUILD_SUMMARY_SQL)).rowcount
@@ -0,0 +1,237 @@
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from datetime import datetime
+from multiprocessing import get_context
+from multiprocessing.context import SpawnContext
+from os import cpu_count
+
+from pandas import isna
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.helpers import ContextHelper, EnvVarsTranslater
+from src.logs import logger
+from src.models import CURRENT_TRANSACTION_ID, EquipmentReading, equipment_change_seq
+from src.routers.helpers.devices import record_devices
+from src.routers.helpers.reading_hooks import on_readings_written
+from src.routers.helpers.session_configuration import configure_pooled_session
+
+UPSERT_BATCH_SIZE = 5000
+
+# every other column of the csv is skipped by the parser
+UPLOAD_COLUMNS = ('equipmentId', 'timestamp', 'value')
+
+# ids and timestamps are kept as text: pandas guesses types chunk by chunk,
+# so an id like 007 would be read as 7 in some chunks and not in others.
+# value is checked by normalize_rows, which names the value that isn't a number
+UPLOAD_DTYPES = {
+    'equipmentId': str,
+    'timestamp': str,
+}
+
+
+def get_upload_workers() -> int:
+    return EnvVarsTranslater.get_int('UPLOAD_WORKERS', default=min(cpu_count() or 1, 4))
+
+
+def get_parallel_min_rows() -> int:
+    return EnvVarsTranslater.get_int('UPLOAD_PARALLEL_MIN_ROWS', default=50000)
+
+
+def get_upload_chunk_rows() -> int:
+    return EnvVarsTranslater.get_int('UPLOAD_CHUNK_ROWS', default=100000)
+
+
+def normalize_timestamp(ts):
+    if isinstance(ts, str):
+        return datetime.fromisoformat(ts).replace(tzinfo=None)
+    return ts.replace(tzinfo=None)
+
+
+def standardize_equipment_id(equipment_id: str) -> str:
+    if isna(equipment_id):
+        equipment_id = ''
+    else:
+        equipment_id = str(equipment_id)
+
+    equipment_id = equipment_id.strip()
+    if not equipment_id:
+        raise ValueError(
+            "A coluna equipmentId não está preenchida corretamente (existe algum valor que está em branco, por exemplo).")
+
+    return equipment_id
+
+
+def standardize_timestamp(timestamp: datetime) -> datetime:
+    if isna(timestamp):
+        timestamp = ''
+    else:
+        timestamp = timestamp
+
+    timestamp = timestamp.strip()
+    if not timestamp:
+        raise ValueError(
+            "A coluna timestamp não está preenchida corretamente (existe algum valor que está em branco, por exemplo).")
+
+    return timestamp
+
+
+def standardize_value(value) -> float | None:
+    if isna(value):
+        return None
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(
+            f"A coluna value não está preenchida corretamente (o valor '{value}' não é numérico, por exemplo).")
+
+
+def get_partition(equipment_id, partitions: int) -> int:
+    # crc32 instead of hash(): it must be stable across the pool processes
+    if isna(equipment_id):
+        return 0
+    return zlib.crc32(str(equipment_id).strip().encode('utf-8')) % partitions
+
+
+def partition_rows(rows: list[dict], partitions: int) -> list[list[dict]]:
+    buckets: list[list[dict]] = [[] for _ in range(max(partitions, 1))]
+
+    for row in rows:
+        buckets[get_partition(row.get('equipmentId'), len(buckets))].append(row)
+
+    return [bucket for bucket in buckets if bucket]
+
+
+def normalize_rows(rows: list[dict]) -> list[dict]:
+    rows_by_equipment_id_and_timestamp = {}
+
+    for columns in rows:
+        equipment_id = standardize_equipment_id(columns['equipmentId'])
+        timestamp = normalize_timestamp(
+            standardize_timestamp(columns['timestamp']))
+
+        value = standardize_value(columns.get('value'))
+
+        rows_by_equipment_id_and_timestamp[(equipment_id, timestamp)] = {
+            'equipmentId': equipment_id,
+            'timestamp': timestamp,
+            'value': value,
+        }
+
+    return list(rows_by_equipment_id_and_timestamp.values())
+
+
+def upsert_readings(session: Session, rows: list[dict]) -> int:
+    if not rows:
+        return 0
+
+    device_keys = record_devices(session, rows)
+    equipment_ids = {device_key: equipment_id for equipment_id, device_key in device_keys.items()}
+
+    readings = EquipmentReading.__table__
+    statement = insert(readings)
+    # readings sent again with the same value are left alone, so they don't
+    # show up again in the change feed
+    statement = statement.on_conflict_do_update(
+        constraint='equipment_pkey',
+        set_={'value': statement.excluded.value,
+              'change_seq': equipment_change_seq.next_value(),
+              'change_xid': CURRENT_TRANSACTION_ID},
+        where=readings.c.value.is_distinct_from(statement.excluded.value)
+    ).returning(readings.c.device_key,
+                readings.c.timestamp,
+                readings.c.value,
+                # xmax is only 0 on rows this statement inserted
+                literal_column('xmax = 0').label('inserted'))
+
+    written_rows = []
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        batch = [{'device_key': device_keys[row['equipmentId']],
+                  'timestamp': row['timestamp'],
+                  'value': row['value']}
+                 for row in rows[start:start + UPSERT_BATCH_SIZE]]
+
+        for device_key, timestamp, value, inserted in session.execute(statement, batch):
+            written_rows.append({'equipmentId': equipment_ids[device_key], 'timestamp': timestamp,
+                                 'value': value, 'inserted': inserted})
+
+    on_readings_written(session, written_rows)
+    # readings resent with the value they already had are not returned
+    return len(written_rows)
+
+
+def write_partition(rows: list[dict]) -> int:
+    with closing(configure_pooled_session()) as session:
+        try:
+            written_rows = upsert_readings(session, rows)
+            session.commit()
+            return written_rows
+        except Exception:
+            session.rollback()
+            raise
+
+
+def get_normalizer_context() -> SpawnContext:
+    """
+    Normalizers are spawned, not forked: a fork of the threaded uWSGI
+    worker would copy the locks held by its other threads and its open
+    database connections.
+    """
+    context = get_context('spawn')
+    if ContextHelper.is_running_inside_wsgi():
+        # sys.executable is the uwsgi binary there, not an interpreter
+        context.set_executable(os.path.join(sys.exec_prefix, 'bin', 'python3'))
+    return context
+
+
+@contextmanager
+def upload_executors():
+    """
+    Keeps one normalizing process pool and one writer thread pool alive for
+    a whole upload, so chunked uploads don't pay the pool start-up per
+    chunk. The normalizers are only spawned on the first parallel chunk.
+    """
+    workers = get_upload_workers()
+
+    if workers <= 1:
+        yield None
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_normalizer_context()) as normalizers, \
+            ThreadPoolExecutor(max_workers=workers) as writers:
+        yield normalizers, writers
+
+
+def ingest_partitions(session: Session,
+                      partitions: list[list[dict]],
+                      executors: tuple[ProcessPoolExecutor, ThreadPoolExecutor] | None = None) -> int:
+    """
+    Normalizes and writes rows already partitioned by equipmentId.
+
+    Small chunks, or calls without executors, are written serially through
+    the given session, so the chunk is written atomically. Large ones are
+    normalized across the process pool, which the GIL doesn't hold back,
+    and each partition is written by a writer thread over its own pooled
+    connection as soon as it is normalized, so the round trips to Postgres
+    overlap; since partitions never share an equipmentId they never contend
+    on the same keys. Each partition commits on its own, and because every
+    write is an upsert a failed upload is resumed by simply sending the same
+    file again.
+    """
+    total_rows = sum(len(partition) for partition in partitions)
+
+    if executors is None or len(partitions) <= 1 or total_rows < get_parallel_min_rows():
+        return sum(upsert_readings(session, normalize_rows(partition))
+                   for partition in partitions)
+
+    logger.debug(
+        f"Ingesting {total_rows} rows over {len(partitions)} partitions")
+
+    normalizers, writers = executors
+    normalized_partitions = normalizers.map(normalize_rows, partitions)
+    return sum(writers.map(write_partition, normalized_partitions))
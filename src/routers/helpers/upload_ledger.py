@@ -0,0 +1,77 @@
+from hashlib import sha256
+
+from pandas import DataFrame
+from pandas.util import hash_pandas_object
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.helpers import CurrentTime
+from src.models import UploadChunk, UploadLedger
+
+APPLIED = 'applied'
+FAILED = 'failed'
+
+
+def hash_chunk(workbook: DataFrame, columns: list[str]) -> str:
+    content_hash = sha256(','.join(columns).encode('utf-8'))
+    content_hash.update(
+        hash_pandas_object(workbook[columns], index=False).values.tobytes())
+    return content_hash.hexdigest()
+
+
+def find_applied_upload(session: Session, content_hash: str) -> UploadLedger | None:
+    return session.query(UploadLedger) \
+        .filter(UploadLedger.content_hash == content_hash) \
+        .filter(UploadLedger.status == APPLIED) \
+        .first()
+
+
+def record_upload(session: Session,
+                  content_hash: str,
+                  filename: str,
+                  status: str,
+                  stats: dict | None = None,
+                  message: str | None = None) -> UploadLedger:
+    upload: UploadLedger = session.query(UploadLedger) \
+        .filter(UploadLedger.content_hash == content_hash) \
+        .first()
+
+    # a forced re-upload that fails doesn't undo the upload that was applied
+    if upload and upload.status == APPLIED and status == FAILED:
+        return upload
+
+    if not upload:
+        upload = UploadLedger(
+            content_hash=content_hash,
+            filename=filename,
+            status=status,
+            created_at=CurrentTime.current_time(),
+        )
+        session.add(upload)
+
+    stats = stats or {}
+
+    upload.filename = filename
+    upload.status = status
+    upload.rows_read = stats.get('rows_read', 0)
+    upload.rows_written = stats.get('rows_written', 0)
+    upload.chunks_skipped = stats.get('chunks_skipped', 0)
+    upload.message = message
+    upload.created_at = CurrentTime.current_time()
+
+    session.flush()
+    return upload
+
+
+def is_chunk_applied(session: Session, chunk_hash: str) -> bool:
+    return session.get(UploadChunk, chunk_hash) is not None
+
+
+def record_chunk(session: Session, chunk_hash: str, rows: int) -> None:
+    session.execute(
+        insert(UploadChunk.__table__)
+        .values(content_hash=chunk_hash,
+                rows=rows,
+                created_at=CurrentTime.current_time())
+        .on_conflict_do_nothing()
+    )
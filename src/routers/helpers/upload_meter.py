@@ -0,0 +1,43 @@
+import os
+import resource
+from time import perf_counter
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def get_rss_bytes() -> int:
+    """Resident memory of this process, or its high-water mark where /proc is missing."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+
+
+class UploadMeter():
+    """
+    Throughput and peak resident memory of an upload. Memory is sampled
+    at every step of every chunk (parsed, loaded, written), which is where
+    it peaks. The writer threads of large uploads run in the same
+    process, so they are counted too; the normalizing processes are not.
+    """
+
+    def __init__(self):
+        self.started_at = perf_counter()
+        self.start_rss = self.peak_rss = get_rss_bytes()
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, get_rss_bytes())
+
+    def report(self, rows: int) -> dict:
+        self.sample()
+        elapsed = perf_counter() - self.started_at
+
+        return {
+            'elapsed_seconds': round(elapsed, 2),
+            'rows_per_second': round(rows / elapsed) if elapsed else 0,
+            'peak_memory_mb': round(self.peak_rss / 2 ** 20, 1),
+            'memory_growth_mb': round((self.peak_rss - self.start_rss) / 2 ** 20, 1),
+        }
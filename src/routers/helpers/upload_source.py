@@ -0,0 +1,155 @@
+import gzip
+import io
+from hashlib import sha256
+from typing import IO, Iterator
+from zipfile import ZipFile
+
+from flask import Request
+from werkzeug.utils import secure_filename
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_BUFFER_SIZE = 1024 * 1024
+
+RAW_UPLOAD_MIMETYPES = {
+    'application/gzip',
+    'application/octet-stream',
+    'application/x-gzip',
+    'application/zip',
+    'application/zstd',
+    'text/csv',
+}
+
+GZIP_SIGNATURE = b'\x1f\x8b'
+ZSTD_SIGNATURE = b'\x28\xb5\x2f\xfd'
+ZIP_SIGNATURE = b'PK\x03\x04'
+
+
+class PrefixedStream(io.RawIOBase):
+    """Replays the bytes already read to sniff the format of a non-seekable stream."""
+
+    def __init__(self, prefix: bytes, stream: IO[bytes]):
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class HashingStream(io.RawIOBase):
+    """Hashes a non-seekable stream while it is consumed."""
+
+    def __init__(self, stream: IO[bytes]):
+        self._stream = stream
+        self.hash = sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        self.hash.update(data)
+        return len(data)
+
+    def hexdigest(self) -> str:
+        for _ in iter(lambda: self.read(READ_BUFFER_SIZE), b''):
+            pass
+
+        return self.hash.hexdigest()
+
+
+def hash_stream(stream: IO[bytes]) -> str:
+    content_hash = sha256()
+
+    for block in iter(lambda: stream.read(READ_BUFFER_SIZE), b''):
+        content_hash.update(block)
+
+    stream.seek(0)
+    return content_hash.hexdigest()
+
+
+def get_upload_stream(request_data: Request) -> tuple[str, IO[bytes]]:
+    """
+    Returns the uploaded file without copying it anywhere.
+
+    Multipart uploads are read from the form file. Any other accepted
+    content type is read straight from the request body, which skips the
+    temporary copy werkzeug makes of large multipart parts.
+    """
+    if 'file' in request_data.files:
+        file_uploaded = request_data.files['file']
+        return secure_filename(file_uploaded.filename), file_uploaded.stream
+
+    if request_data.mimetype in RAW_UPLOAD_MIMETYPES:
+        filename = secure_filename(
+            request_data.args.get('filename', 'upload.csv'))
+        return filename, request_data.stream
+
+    raise Exception(f"The file key 'file' must be sent")
+
+
+def sniff_stream(stream: IO[bytes]) -> tuple[bytes, IO[bytes]]:
+    if stream.seekable():
+        signature = stream.read(len(ZSTD_SIGNATURE))
+        stream.seek(0)
+        return signature, stream
+
+    signature = stream.read(len(ZSTD_SIGNATURE))
+    return signature, io.BufferedReader(PrefixedStream(signature, stream),
+                                        buffer_size=READ_BUFFER_SIZE)
+
+
+def iter_csv_streams(filename: str, stream: IO[bytes]) -> Iterator[tuple[str, IO[bytes]]]:
+    """
+    Yields a decompressed, streaming reader for every CSV in the upload.
+
+    Plain, gzip and zstd CSVs yield a single stream; zip archives yield one
+    stream per .csv member. Nothing is decompressed up front, so memory only
+    depends on how the caller consumes the streams.
+    """
+    signature, stream = sniff_stream(stream)
+
+    if signature.startswith(GZIP_SIGNATURE):
+        yield filename, gzip.GzipFile(fileobj=stream, mode='rb')
+
+    elif signature.startswith(ZSTD_SIGNATURE):
+        if zstandard is None:
+            raise Exception(
+                "zstd uploads require the 'zstandard' package to be installed")
+        yield filename, zstandard.ZstdDecompressor().stream_reader(
+            stream, read_size=READ_BUFFER_SIZE)
+
+    elif signature.startswith(ZIP_SIGNATURE):
+        if not stream.seekable():
+            raise Exception(
+                "Zip archives must be sent as a multipart file; use gzip or zstd to stream the request body")
+
+        with ZipFile(stream) as archive:
+            members = [member for member in archive.infolist()
+                       if not member.is_dir() and member.filename.lower().endswith('.csv')]
+
+            if not members:
+                raise Exception(
+                    f"The archive '{filename}' does not contain any csv file")
+
+            for member in members:
+                with archive.open(member) as member_stream:
+                    yield f"{filename}/{member.filename}", member_stream
+
+    else:
+        yield filename, stream
@@ -0,0 +1,195 @@
+import atexit
+import os
+from contextlib import closing
+from functools import lru_cache
+from threading import Condition, Event, Thread
+from time import monotonic
+
+from src.helpers import ContextHelper, EnvVarsTranslater, metrics
+from src.logs import logger
+from src.routers.helpers.session_configuration import configure_pooled_session
+from src.routers.helpers.upload_ingest import upsert_readings
+
+ACK_ON_FLUSH = 'flush'
+ACK_ON_ENQUEUE = 'enqueue'
+FLUSH_TIMEOUT_SECONDS = 10
+
+
+class PendingWrite():
+    """Resolved once the batch holding the reading is committed, or has failed."""
+
+    def __init__(self):
+        self._done = Event()
+        self.error: Exception | None = None
+
+    def resolve(self, error: Exception | None = None):
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout: float | None = FLUSH_TIMEOUT_SECONDS) -> bool:
+        """True once committed, False if it is still pending after `timeout`."""
+        if not self._done.wait(timeout):
+            return False
+        if self.error:
+            raise self.error
+        return True
+
+
+class WriteBuffer():
+    """
+    Coalesces single readings into multi-row upserts.
+
+    Readings are appended to an in-memory buffer of this worker and a
+    background thread writes them in one transaction every `flush_ms`
+    milliseconds, or as soon as `max_rows` are waiting. The thread is
+    started on the first reading, so it is created inside the uWSGI worker
+    and not in the master before the fork. Whatever is left in the buffer
+    is flushed when the worker exits.
+    """
+
+    def __init__(self, flush_ms: int = 50, max_rows: int = 1000):
+        self.flush_ms = flush_ms
+        self.max_rows = max_rows
+        self._rows: list[dict] = []
+        self._pending: list[PendingWrite] = []
+        self._condition = Condition()
+        self._thread: Thread | None = None
+        self._pid = None
+        self._stopping = False
+
+    def enqueue(self, row: dict) -> PendingWrite:
+        pending = PendingWrite()
+
+        with self._condition:
+            self._ensure_started()
+            self._rows.append(row)
+            self._pending.append(pending)
+
+            if len(self._rows) >= self.max_rows:
+                self._condition.notify()
+
+        metrics.increment('equipment.buffer.enqueued')
+        return pending
+
+    def withdraw(self, pending: PendingWrite) -> bool:
+        """
+        Takes a reading that is still waiting out of the buffer, so it is
+        never written. Returns False when its batch is already being written.
+        """
+        with self._condition:
+            for index, write in enumerate(self._pending):
+                if write is pending:
+                    del self._rows[index], self._pending[index]
+                    return True
+
+        return False
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = Thread(target=self._run,
+                              name='equipment-write-buffer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = monotonic() + self.flush_ms / 1000
+                while not self._stopping and len(self._rows) < self.max_rows:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                if self._stopping:
+                    return
+
+            self.flush()
+
+    def flush(self) -> int:
+        with self._condition:
+            rows, self._rows = self._rows, []
+            pending, self._pending = self._pending, []
+
+        if not rows:
+            return 0
+
+        # the same reading twice in one statement would make ON CONFLICT fail
+        unique_rows = list({(row['equipmentId'], row['timestamp']): row
+                            for row in rows}.values())
+
+        try:
+            with metrics.timer('equipment.buffer.flush'), \
+                    closing(configure_pooled_session()) as session:
+                try:
+                    upsert_readings(session, unique_rows)
+                    session.commit()
+                except Exception:
+                    session.rollback()
+                    raise
+        except Exception as ex:
+            logger.exception(f'Unable to flush {len(rows)} buffered readings')
+            metrics.increment('equipment.buffer.failed_rows', len(rows))
+            for write in pending:
+                write.resolve(ex)
+            return 0
+
+        metrics.increment('equipment.commits')
+        metrics.increment('equipment.buffer.flushed_rows', len(rows))
+        for write in pending:
+            write.resolve()
+
+        return len(rows)
+
+    def close(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join()
+
+        flushed_rows = self.flush()
+        if flushed_rows:
+            logger.info(f'Flushed {flushed_rows} buffered readings on shutdown')
+
+
+def is_write_buffer_enabled() -> bool:
+    return EnvVarsTranslater.get_bool('WRITE_BUFFER_ENABLED', default=False)
+
+
+def get_write_buffer_ack() -> str:
+    ack = os.getenv('WRITE_BUFFER_ACK', ACK_ON_FLUSH).strip().lower()
+    if ack not in (ACK_ON_FLUSH, ACK_ON_ENQUEUE):
+        raise ValueError(f"WRITE_BUFFER_ACK must be '{
+                         ACK_ON_FLUSH}' or '{ACK_ON_ENQUEUE}'")
+    return ack
+
+
+@lru_cache
+def get_write_buffer() -> WriteBuffer:
+    write_buffer = WriteBuffer(
+        flush_ms=EnvVarsTranslater.get_int('WRITE_BUFFER_FLUSH_MS', default=50),
+        max_rows=EnvVarsTranslater.get_int('WRITE_BUFFER_MAX_ROWS', default=1000)
+    )
+
+    atexit.register(write_buffer.close)
+
+    if ContextHelper.is_running_inside_wsgi():
+        import uwsgi
+
+        # with die-on-term uWSGI runs this hook when each worker goes down
+        previous_atexit = getattr(uwsgi, 'atexit', None)
+
+        def close_write_buffer():
+            write_buffer.close()
+            if previous_atexit:
+                previous_atexit()
+
+        uwsgi.atexit = close_write_buffer
+
+    return write_buffer
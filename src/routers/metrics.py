@@ -0,0 +1,16 @@
+from http import HTTPStatus
+
+from flask_restx import Resource
+from flask_smorest import Blueprint
+
+from src.helpers import metrics
+from src.routers.helpers import get_response, token_required
+
+metrics_blueprint = Blueprint("Metrics", __name__)
+
+
+@metrics_blueprint.route('/metrics')
+class RouteMetrics(Resource):
+    @token_required
+    def get(self):
+        return get_response(HTTPStatus.OK, metrics.snapshot())
@@ -1,18 +1,45 @@
-from datetime import datetime
+import gzip
+import os
+import tracemalloc
+from datetime import datetime, timedelta
 from io import BytesIO
+from threading import BoundedSemaphore, Event, Thread
+from time import monotonic, sleep
+from unittest.mock import MagicMock, patch
+from zipfile import ZipFile
+import jwt
 import pytz
 from werkzeug.datastructures import FileStorage
 
 
+from flask import Flask, g
 from flask_testing import TestCase
 from pandas import DataFrame
 import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
 
 from src.app import create_app
-from src.config import db
-from src.helpers import CurrentTime
+from src.config import ReplicaRouter, db
+from src.helpers import CurrentTime, Metrics
+from src.routers.helpers import EncodedJson, get_encoded_response, get_response
 from src.routers import standardize_equipment_id, load_columns
-from src.models import Equipment
+from src.routers import equipment as equipment_module
+from src.routers.equipment import get_listing_params, get_listing_statements, get_requested_fields
+from src.routers.helpers import HashingStream, hash_chunk, hash_stream, iter_csv_streams, normalize_rows, partition_rows
+from src.routers.helpers import APPLIED, FAILED, configure_pooled_session, get_pooled_engine, get_changes_since, get_last_change_seq, get_safe_change_seq, record_upload, upsert_readings
+from src.routers.helpers import RetentionPolicy, VersionedCache, WriteBuffer, facet_cache, get_policy, is_compacted, migrate_storage
+from src.routers.helpers import upload_ingest as upload_ingest_module
+from src.routers.helpers import write_buffer as write_buffer_module
+from src.routers.helpers import ReadingsListener, open_stream
+from src.routers.helpers import live_stream as live_stream_module
+from src.routers.helpers import SingleFlight, escape_like
+from src.routers.helpers.admission import AdmissionController
+from src.routers.helpers.profiling import RequestProfile, RequestProfiler
+from src.routers.helpers.stats import merge_totals, summarize
+from src.routers.helpers.summary import record_summary
+from src.models import Equipment, EquipmentDevice, EquipmentReading, EquipmentSchema, EquipmentSummary, QueryResult, UploadLedger, get_row_encoder
 
 
 def test_standardize_equipment_id_valid():
@@ -43,6 +70,920 @@ def test_load_columns():
     assert result[0]['equipmentId'] == 'ABC123'
 
 
+def get_upload_peak_memory(rows: int) -> int:
+    csv = BytesIO(b'equipmentId;timestamp;value;note\n' + b''.join(
+        f'EQ-{index % 50};2023-02-12T01:{index % 60:02d}:00.000-05:00;{index}.5;n{index}\n'.encode()
+        for index in range(rows)))
+
+    tracemalloc.start()
+    try:
+        stats = equipment_module.read_file(MagicMock(), 'equipment.csv', csv)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert stats['rows_read'] == rows
+    assert stats['ingest']['rows_per_second'] > 0
+    return peak
+
+
+def test_read_file_memory_does_not_grow_with_the_file(monkeypatch):
+    monkeypatch.setenv('UPLOAD_CHUNK_ROWS', '1000')
+    monkeypatch.setenv('UPLOAD_WORKERS', '1')
+    monkeypatch.setattr(equipment_module, 'is_chunk_applied', lambda session, chunk_hash: False)
+    monkeypatch.setattr(equipment_module, 'record_chunk', lambda session, chunk_hash, rows: None)
+    monkeypatch.setattr(upload_ingest_module, 'upsert_readings', lambda session, rows: len(rows))
+
+    small_file_peak = get_upload_peak_memory(10000)
+    large_file_peak = get_upload_peak_memory(80000)
+
+    assert large_file_peak < 8 * 2 ** 20
+    assert large_file_peak < small_file_peak * 1.5
+
+
+def test_normalize_rows_rejects_values_that_are_not_numbers():
+    with pytest.raises(ValueError, match="o valor 'abc' não é numérico"):
+        normalize_rows([{'equipmentId': 'EQ-1', 'timestamp': '2023-02-12T01:30:00.000-05:00', 'value': 'abc'}])
+
+
+def test_large_chunks_are_normalized_in_spawned_processes(monkeypatch):
+    monkeypatch.setenv('UPLOAD_WORKERS', '2')
+    monkeypatch.setenv('UPLOAD_PARALLEL_MIN_ROWS', '1')
+    written = []
+    monkeypatch.setattr(upload_ingest_module, 'write_partition',
+                        lambda rows: written.extend(rows) or len(rows))
+    rows = [{'equipmentId': f' EQ-{index % 8} ', 'timestamp': f'2023-02-12T01:{index // 8:02d}:00', 'value': index}
+            for index in range(40)]
+    partitions = partition_rows(rows, 2)
+    assert len(partitions) == 2
+
+    with upload_ingest_module.upload_executors() as executors:
+        normalizers, _ = executors
+        assert normalizers._mp_context.get_start_method() == 'spawn'
+        total = upload_ingest_module.ingest_partitions(MagicMock(), partitions, executors)
+
+        with pytest.raises(ValueError, match='equipmentId'):
+            upload_ingest_module.ingest_partitions(
+                MagicMock(), [[{'equipmentId': ' ', 'timestamp': '2023-02-12T01:00:00', 'value': 1}]] * 2, executors)
+
+    assert total == len(written) == 40
+    assert {row['equipmentId'] for row in written} == {f'EQ-{index}' for index in range(8)}
+    assert all(isinstance(row['timestamp'], datetime) for row in written)
+
+
+def test_union_is_ordered_like_the_listing():
+    assert str(equipment_module.get_union_order(('equipmentId', 'timestamp', 'value'))) == '1, 2'
+    assert str(equipment_module.get_union_order(('timestamp', 'value'))) == '1'
+    assert str(equipment_module.get_union_order(('value',))) == '1'
+
+
+def test_partition_rows_keeps_equipment_together():
+    rows = [{'equipmentId': f'EQ-{index % 7}', 'timestamp': '2023-02-12T01:30:00.000-05:00', 'value': index}
+            for index in range(100)]
+    partitions = partition_rows(rows, 4)
+    assert sum(len(partition) for partition in partitions) == 100
+    for partition in partitions:
+        equipment_ids = {row['equipmentId'] for row in partition}
+        for other in partitions:
+            if other is not partition:
+                assert equipment_ids.isdisjoint(
+                    row['equipmentId'] for row in other)
+
+
+def test_normalize_rows_keeps_last_duplicate():
+    rows = [
+        {'equipmentId': ' ABC123 ', 'timestamp': '2023-02-12T01:30:00.000-05:00', 'value': 1.0},
+        {'equipmentId': 'ABC123', 'timestamp': '2023-02-12T01:30:00.000-05:00', 'value': float('nan')},
+    ]
+    result = normalize_rows(rows)
+    assert result == [{'equipmentId': 'ABC123',
+                       'timestamp': datetime(2023, 2, 12, 1, 30),
+                       'value': None}]
+
+
+def test_iter_csv_streams_decompresses_gzip():
+    content = b'equipmentId;timestamp;value\nABC123;2023-02-12T01:30:00.000-05:00;1.5\n'
+    streams = list(iter_csv_streams('test.csv.gz', BytesIO(gzip.compress(content))))
+    assert len(streams) == 1
+    assert streams[0][1].read() == content
+
+
+def test_iter_csv_streams_reads_every_csv_in_zip():
+    archive = BytesIO()
+    with ZipFile(archive, 'w') as zip_file:
+        zip_file.writestr('first.csv', 'equipmentId;timestamp;value\n')
+        zip_file.writestr('second.csv', 'equipmentId;timestamp;value\n')
+        zip_file.writestr('notes.txt', 'ignored')
+    archive.seek(0)
+
+    names = [name for name, _ in iter_csv_streams('test.zip', archive)]
+    assert names == ['test.zip/first.csv', 'test.zip/second.csv']
+
+
+def test_row_encoder_matches_equipment_schema():
+    equipments = [
+        Equipment('ABC123', datetime(2023, 2, 12, 1, 30), 50.55),
+        Equipment('Équipement "7"', datetime(2023, 2, 12, 1, 30, 0, 123), None),
+        Equipment('EQ-2', datetime(2023, 2, 12), 1e-07),
+    ]
+    rows = [(equipment.equipmentId, equipment.timestamp, equipment.value)
+            for equipment in equipments]
+
+    with create_app('testing').app_context():
+        expected = get_response(200, {'total': 3,
+                                      'equipments': EquipmentSchema(many=True).dump(equipments),
+                                      'message': 'Request happened successfully'})
+        encoded = get_encoded_response(200, {'total': 3,
+                                             'equipments': EncodedJson(get_row_encoder().encode(rows)),
+                                             'message': 'Request happened successfully'})
+
+    assert encoded.get_data() == expected.get_data()
+
+
+def test_row_encoder_writes_only_requested_fields():
+    encoder = get_row_encoder(('value', 'timestamp'))
+    assert encoder.fields == ('timestamp', 'value')
+    assert encoder.encode([(datetime(2023, 2, 12, 1, 30), 50.55)]) == \
+        '[{"timestamp":"2023-02-12T01:30:00","value":50.55}]'
+
+
+def test_get_requested_fields():
+    app = create_app('testing')
+
+    with app.test_request_context('/equipment?fields=value,timestamp&fields=value'):
+        assert get_requested_fields() == ('value', 'timestamp')
+
+    with app.test_request_context('/equipment?column_name=equipmentId&fields=last_24'):
+        assert get_requested_fields('equipmentId') == ('last_24',)
+
+    with app.test_request_context('/equipment?fields=pwd'):
+        with pytest.raises(ValueError, match="Unknown fields: pwd"):
+            get_requested_fields()
+
+    with app.test_request_context('/equipment?column_name=pwd'):
+        with pytest.raises(ValueError, match="Unknown column_name 'pwd'"):
+            get_requested_fields('pwd')
+
+
+def test_hashing_stream_matches_hash_stream():
+    content = b'equipmentId;timestamp;value\n' * 1000
+    hashing_stream = HashingStream(BytesIO(content))
+    hashing_stream.read(10)
+    assert hashing_stream.hexdigest() == hash_stream(BytesIO(content))
+
+
+def test_hash_chunk_ignores_column_order_and_index():
+    columns = ['equipmentId', 'timestamp', 'value']
+    df = DataFrame({
+        'value': [50.55, None],
+        'equipmentId': ['ABC123', 'ABC124'],
+        'timestamp': ['2023-02-12T01:30:00.000-05:00', '2023-02-12T01:30:00.000-05:00'],
+    })
+    shifted = df[columns].set_index(df.index + 1000)
+    assert hash_chunk(df, columns) == hash_chunk(shifted, columns)
+    assert hash_chunk(df, columns) != hash_chunk(df.assign(value=[50.56, None]), columns)
+
+
+def test_failed_forced_upload_keeps_the_applied_record():
+    applied = UploadLedger(content_hash='abc', filename='equipment.csv',
+                           status=APPLIED, created_at=datetime(2024, 1, 1))
+    applied.rows_written = 10
+    session = MagicMock()
+    session.query.return_value.filter.return_value.first.return_value = applied
+
+    upload = record_upload(session, 'abc', 'equipment.csv', FAILED, message='boom')
+
+    assert upload.status == APPLIED
+    assert upload.rows_written == 10 and upload.message is None
+
+
+def test_replica_router_skips_broken_replicas_and_sticks_after_write(tmp_path):
+    app = Flask(__name__)
+    router = ReplicaRouter()
+    router.init_app(app, [f"sqlite:///{tmp_path / 'replica.db'}",
+                          f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"])
+
+    with app.test_request_context():
+        assert {router.get_read_engine(user_id=1) for _ in range(4)} == {router.engines[0]}
+
+        router.mark_write(user_id=1)
+        assert router.get_read_engine(user_id=1) is None
+        assert router.get_read_engine(user_id=2) is router.engines[0]
+
+    with app.test_request_context(headers={'Cookie': 'db_primary_until=9999999999'}):
+        assert router.get_read_engine(user_id=3) is None
+
+
+def test_replica_router_forgets_expired_writes():
+    router = ReplicaRouter()
+    router.sticky_seconds = 0
+
+    for user_id in range(100):
+        router.mark_write(user_id=user_id)
+
+    assert len(router._last_write_by_user) <= 1
+    assert not router.is_sticky(user_id=0)
+
+
+def test_routing_session_reads_from_request_engine(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    db.init_app(app)
+    router = ReplicaRouter()
+    router.init_app(app, [f"sqlite:///{tmp_path / 'replica.db'}"])
+
+    with app.app_context():
+        assert db.session.get_bind() is db.engine
+
+        g.read_engine = router.get_read_engine()
+        assert db.session.get_bind() is router.engines[0]
+        db.session.remove()
+
+
+def test_dropdown_is_shared_only_between_requests_reading_the_same_database():
+    app = Flask(__name__)
+
+    with app.app_context(), patch.object(equipment_module.dropdown_flight, 'do') as do:
+        equipment_module.query_column('equipmentId', MagicMock(), ('value',))
+        g.read_engine = MagicMock()
+        equipment_module.query_column('equipmentId', MagicMock(), ('value',))
+
+    assert [call.args[0] for call in do.call_args_list] == [('primary', ('value',)), ('replica', ('value',))]
+
+
+def test_retention_policy_cutoff_is_aligned_to_buckets():
+    now = datetime(2024, 7, 26, 15, 42, 10)
+
+    assert RetentionPolicy(3, 'hour').get_cutoff(now) == datetime(2024, 7, 23, 15)
+    assert RetentionPolicy(3, 'day').get_cutoff(now) == datetime(2024, 7, 23)
+    assert not RetentionPolicy(0).enabled
+
+    with pytest.raises(ValueError, match="Unsupported retention granularity"):
+        RetentionPolicy(3, 'week')
+
+
+def test_retention_overrides_take_precedence(monkeypatch):
+    monkeypatch.setenv('RETENTION_RAW_DAYS', '30')
+    monkeypatch.setenv('RETENTION_OVERRIDES', 'EQ-1:90:day, EQ-2:7')
+
+    assert get_policy('EQ-1').raw_days == 90
+    assert get_policy('EQ-1').granularity == 'day'
+    assert get_policy('EQ-2').granularity == 'hour'
+    assert get_policy('EQ-3').raw_days == 30
+
+    assert is_compacted('EQ-2', None)
+    assert not is_compacted('EQ-1', datetime.now() - timedelta(days=30))
+
+
+def test_metrics_snapshot_reports_rates_and_percentiles():
+    registry = Metrics()
+    for millis in range(1, 101):
+        registry.observe('request', millis / 1000)
+    registry.increment('commits', 3)
+
+    snapshot = registry.snapshot()
+
+    assert snapshot['counters']['commits']['total'] == 3
+    assert snapshot['latencies_ms']['request']['p50'] == 51
+    assert snapshot['latencies_ms']['request']['p99'] == 99
+    assert snapshot['latencies_ms']['request']['max'] == 100
+
+
+def test_write_buffer_coalesces_readings_and_flushes_on_close(monkeypatch):
+    batches = []
+    monkeypatch.setattr(write_buffer_module, 'configure_pooled_session', MagicMock)
+    monkeypatch.setattr(write_buffer_module, 'upsert_readings',
+                        lambda session, rows: batches.append(rows))
+
+    buffer = WriteBuffer(flush_ms=60000, max_rows=1000)
+    pending = [buffer.enqueue({'equipmentId': 'EQ-1', 'timestamp': datetime(2024, 7, 26), 'value': value})
+               for value in range(3)]
+    buffer.close()
+
+    assert all(write.wait(timeout=1) for write in pending)
+    assert batches == [[{'equipmentId': 'EQ-1', 'timestamp': datetime(2024, 7, 26), 'value': 2}]]
+
+
+def test_write_buffer_withdraws_readings_not_yet_flushed(monkeypatch):
+    batches = []
+    monkeypatch.setattr(write_buffer_module, 'configure_pooled_session', MagicMock)
+    monkeypatch.setattr(write_buffer_module, 'upsert_readings',
+                        lambda session, rows: batches.append(rows))
+
+    buffer = WriteBuffer(flush_ms=60000, max_rows=1000)
+    kept, withdrawn = [buffer.enqueue({'equipmentId': equipment_id, 'timestamp': datetime(2024, 7, 26), 'value': 1})
+                       for equipment_id in ('EQ-1', 'EQ-2')]
+
+    assert not withdrawn.wait(timeout=0)
+    assert buffer.withdraw(withdrawn)
+    buffer.close()
+
+    assert kept.wait(timeout=1) and not buffer.withdraw(kept)
+    assert [row['equipmentId'] for row in batches[0]] == ['EQ-1']
+
+
+def test_readings_listener_wakes_only_matching_streams():
+    listener = ReadingsListener()
+    listener._ensure_started = lambda: None
+    eq_1 = listener.subscribe({'EQ-1'})
+    eq_2 = listener.subscribe({'EQ-2'})
+
+    listener.dispatch('["EQ-1", "EQ-3"]')
+    assert eq_1.wait(0) and not eq_2.wait(0)
+
+    listener.dispatch('"*"')
+    assert eq_1.wait(0) and eq_2.wait(0)
+
+    listener.unsubscribe(eq_2)
+    listener.dispatch('["EQ-2"]')
+    assert not eq_2.wait(0)
+
+
+def test_open_stream_is_limited_per_worker(monkeypatch):
+    slots = BoundedSemaphore(1)
+    monkeypatch.setattr(live_stream_module, 'get_stream_slots', lambda: slots)
+    app = Flask(__name__)
+
+    with app.test_request_context('/equipment/stream?equipmentId=EQ-1'):
+        first = open_stream({'EQ-1'})
+        rejected = open_stream({'EQ-1'})
+        first.close()
+        reopened = open_stream({'EQ-1'})
+
+    assert first.mimetype == 'text/event-stream'
+    assert rejected.status_code == 503 and 'Retry-After' in rejected.headers
+    assert reopened.mimetype == 'text/event-stream'
+    reopened.close()
+
+
+def test_versioned_cache_recomputes_when_the_version_moves():
+    cache = VersionedCache(max_entries=2)
+    computed = []
+
+    def compute(value):
+        computed.append(value)
+        return value
+
+    assert cache.get('a', 1, lambda: compute('first')) == 'first'
+    assert cache.get('a', 1, lambda: compute('second')) == 'first'
+    assert cache.get('a', 2, lambda: compute('third')) == 'third'
+
+    cache.get('b', 2, lambda: compute('b'))
+    cache.get('c', 2, lambda: compute('c'))
+    assert cache.get('a', 2, lambda: compute('evicted')) == 'evicted'
+    assert computed == ['first', 'third', 'b', 'c', 'evicted']
+
+
+def test_versioned_cache_skips_the_version_while_fresh():
+    cache = VersionedCache(fresh_seconds=60)
+    versions = iter(range(10))
+
+    def get_version():
+        return next(versions)
+
+    assert cache.get('a', get_version, lambda: 'first') == 'first'
+    assert cache.get('a', get_version, lambda: 'second') == 'first'
+    assert next(versions) == 1
+
+    cache.fresh_seconds = 0
+    assert cache.get('a', get_version, lambda: 'third') == 'third'
+
+
+def test_escape_like_matches_wildcards_literally():
+    assert escape_like('EQ_1%') == 'EQ\\_1\\%'
+    assert escape_like('a\\b') == 'a\\\\b'
+
+
+def test_summarize_merges_raw_and_rollup_totals():
+    totals = {}
+    merge_totals(totals, 'EQ-1', 2, 3.0, 5.0, 1.0, 2.0)
+    merge_totals(totals, 'EQ-1', 2, 7.0, 25.0, 3.0, 4.0)
+
+    stats = summarize(totals['EQ-1'], [50.0], [2.5])
+
+    assert stats == {'count': 4, 'avg': 2.5, 'min': 1.0, 'max': 4.0,
+                     'stddev': 1.29, 'percentiles': {'50': 2.5}}
+    assert summarize(None, [], None) == {'count': 0, 'avg': None, 'min': None,
+                                         'max': None, 'stddev': None}
+
+
+def test_record_summary_keeps_the_latest_reading_and_counts_inserts():
+    session = MagicMock()
+    record_summary(session, [
+        {'equipmentId': 'EQ-1', 'timestamp': datetime(2023, 1, 2), 'value': 2.0, 'inserted': True},
+        {'equipmentId': 'EQ-1', 'timestamp': datetime(2023, 1, 1), 'value': 1.0, 'inserted': True},
+        {'equipmentId': 'EQ-1', 'timestamp': datetime(2023, 1, 3), 'value': 3.0, 'inserted': False},
+    ])
+
+    params = session.execute.call_args[0][0].compile().params
+    assert params['last_timestamp_m0'] == datetime(2023, 1, 3)
+    assert params['last_value_m0'] == 3.0
+    assert params['reading_count_m0'] == 2
+
+
+def test_admission_controller_sheds_when_the_pool_is_full(monkeypatch):
+    monkeypatch.setenv('ADMISSION_QUEUE_MS', '10')
+    monkeypatch.setenv('ADMISSION_HEAVY_CONCURRENCY', '1')
+    app = Flask(__name__)
+    controller = AdmissionController()
+    controller.init_app(app)
+
+    with app.test_request_context('/equipment'):
+        assert controller.run('heavy', lambda: g.deadline is not None) is True
+
+        controller.get_pool('heavy').acquire(timeout=0)
+        response = controller.run('heavy', lambda: 'ran')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+
+    with app.test_request_context('/equipment', headers={'X-Request-Start': 't=1'}):
+        assert controller.run('default', lambda: 'ran').status_code == 503
+
+
+def test_heavy_requests_are_shed_while_ordinary_ones_still_run(monkeypatch):
+    monkeypatch.setenv('ADMISSION_QUEUE_MS', '50')
+    monkeypatch.setenv('WORKER_THREADS', '2')
+    app = Flask(__name__)
+    controller = AdmissionController()
+    controller.init_app(app)
+    assert controller.get_pool('default').concurrency == 2
+    assert controller.get_pool('heavy').concurrency == 1
+
+    started, finish = Event(), Event()
+
+    def slow_heavy_request():
+        with app.test_request_context('/equipment/stats'):
+            controller.run('heavy', lambda: started.set() or finish.wait(5))
+
+    worker = Thread(target=slow_heavy_request)
+    worker.start()
+    try:
+        assert started.wait(5)
+        with app.test_request_context('/equipment'):
+            assert controller.run('heavy', lambda: 'ran').status_code == 503
+            assert controller.run('upload', lambda: 'ran') == 'ran'
+            assert controller.run('default', lambda: 'ran') == 'ran'
+    finally:
+        finish.set()
+        worker.join()
+
+
+def test_request_profiler_keeps_the_newest_profiles(tmp_path):
+    profiler = RequestProfiler()
+    profiler.directory, profiler.max_files = str(tmp_path), 2
+
+    for age, name in enumerate(['newest', 'middle', 'oldest']):
+        for extension in ('collapsed', 'json'):
+            path = tmp_path / f'{name}.{extension}'
+            path.write_text('')
+            os.utime(path, (1000 - age, 1000 - age))
+
+    profiler.prune()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'middle.collapsed', 'middle.json', 'newest.collapsed', 'newest.json']
+
+
+def test_concurrent_requests_share_cprofile(monkeypatch, tmp_path):
+    monkeypatch.setenv('PROFILE_TOKEN', 'secret')
+    monkeypatch.setenv('PROFILE_MODE', 'cprofile')
+    monkeypatch.setenv('PROFILE_DIR', str(tmp_path))
+    app = Flask(__name__)
+    RequestProfiler().init_app(app)
+    started, finish = Event(), Event()
+
+    @app.route('/slow')
+    def slow():
+        started.set()
+        finish.wait(5)
+        return 'slow'
+
+    @app.route('/fast')
+    def fast():
+        return 'fast'
+
+    headers = {'X-Profile-Token': 'secret'}
+    responses = []
+    worker = Thread(target=lambda: responses.append(app.test_client().get('/slow', headers=headers)))
+    worker.start()
+    try:
+        assert started.wait(5)
+        response = app.test_client().get('/fast', headers=headers)
+        assert response.status_code == 200
+        assert 'X-Profile-Id' not in response.headers
+    finally:
+        finish.set()
+        worker.join()
+
+    assert responses[0].status_code == 200
+    assert (tmp_path / f"{responses[0].headers['X-Profile-Id']}.pstats").exists()
+    assert 'X-Profile-Id' in app.test_client().get('/fast', headers=headers).headers
+
+
+def test_request_profile_sums_sql_time_per_statement():
+    profile = RequestProfile(profiler=None)
+    profile.record_query('SELECT 1', 0.002)
+    profile.record_query('SELECT 2', 0.010)
+    profile.record_query('SELECT 1', 0.004)
+
+    timing = profile.get_sql_timing()
+
+    assert timing['count'] == 3 and timing['total_ms'] == 16.0
+    assert timing['statements'][0] == {'statement': 'SELECT 2', 'count': 1, 'total_ms': 10.0, 'max_ms': 10.0}
+
+
+def test_single_flight_shares_one_computation_between_concurrent_callers():
+    flight = SingleFlight('test')
+    started, release = Event(), Event()
+    computed, results = [], []
+
+    def compute():
+        computed.append(1)
+        started.set()
+        release.wait(5)
+        return 'shared'
+
+    leader = Thread(target=lambda: results.append(flight.do('key', compute)))
+    leader.start()
+    started.wait(5)
+    followers = [Thread(target=lambda: results.append(flight.do('key', compute))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    sleep(0.05)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+
+    assert results == ['shared'] * 4
+    assert len(computed) == 1
+    assert flight.do('key', lambda: 'again') == 'again'
+
+
+def test_listing_statements_are_reused_and_only_bind_values():
+    app = Flask(__name__)
+
+    with app.test_request_context('/equipment?equipmentId=EQ-1&value=3'):
+        params = get_listing_params([])
+        rows_statement, count_statement = get_listing_statements(('value',), tuple(params))
+
+    assert params == {'equipment_id': 'EQ-1', 'value': '3'}
+    assert get_listing_statements(('value',), ('equipment_id', 'value'))[0] is rows_statement
+    assert 'EQ-1' not in str(rows_statement) and ':equipment_id' in str(count_statement)
+
+
+class DatabaseTestCase(TestCase):
+    def create_app(self):
+        app = create_app('testing')
+        return app
+
+    def setUp(self):
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def get_auth_headers(self) -> dict:
+        token = jwt.encode({'id': 1, 'fullname': 'Test User'}, os.getenv('JWT_CRYPT_KEY'), algorithm='HS256')
+        return {'Authorization': f'Bearer {token}'}
+
+    def write_readings(self, session, equipment_id: str, values: list[float], day: int = 26):
+        upsert_readings(session, [{'equipmentId': equipment_id,
+                                   'timestamp': datetime(2024, 7, day, 0, minute),
+                                   'value': value}
+                                  for minute, value in enumerate(values)])
+
+
+class TestReadingWrites(DatabaseTestCase):
+    def get_summary(self, equipment_id: str):
+        return db.session.get(EquipmentSummary, equipment_id)
+
+    def test_writers_of_the_same_equipment_do_not_wait_on_each_other(self):
+        long_transaction = configure_pooled_session()
+        try:
+            self.write_readings(long_transaction, 'EQ-1', [1, 2])
+            long_transaction.flush()
+
+            db.session.execute(text("SET LOCAL lock_timeout = '2s'"))
+            self.write_readings(db.session, 'EQ-1', [3], day=27)
+            db.session.commit()
+            self.assertEqual(self.get_summary('EQ-1').reading_count, 1)
+
+            long_transaction.commit()
+        finally:
+            long_transaction.close()
+
+        db.session.expire_all()
+        summary = self.get_summary('EQ-1')
+        self.assertEqual((summary.reading_count, summary.last_value), (3, 3))
+
+        device = db.session.query(EquipmentDevice).filter_by(equipmentId='EQ-1').one()
+        self.assertEqual((device.first_seen, device.last_seen),
+                         (datetime(2024, 7, 26), datetime(2024, 7, 27)))
+
+    def test_rolled_back_readings_are_not_summarized(self):
+        self.write_readings(db.session, 'EQ-2', [1])
+        db.session.rollback()
+        self.write_readings(db.session, 'EQ-2', [2, 3], day=27)
+        db.session.commit()
+
+        self.assertEqual(self.get_summary('EQ-2').reading_count, 2)
+
+
+class TestChangeFeed(DatabaseTestCase):
+
+    def test_changes_are_returned_in_sequence_order_and_resume_from_the_cursor(self):
+        since = get_last_change_seq(db.session)
+        self.write_readings(db.session, 'EQ-1', [1, 2])
+        db.session.commit()
+        self.write_readings(db.session, 'EQ-2', [3])
+        db.session.commit()
+
+        changes = get_changes_since(db.session, since, 10)
+        self.assertEqual([(equipment_id, value) for _, equipment_id, _, value in changes],
+                         [('EQ-1', 1), ('EQ-1', 2), ('EQ-2', 3)])
+        self.assertEqual([seq for seq, *_ in changes], sorted(seq for seq, *_ in changes))
+
+        first_page = get_changes_since(db.session, since, 2)
+        next_page = get_changes_since(db.session, first_page[-1][0], 2)
+        self.assertEqual(first_page + next_page, changes)
+        self.assertEqual(get_changes_since(db.session, changes[-1][0], 10), [])
+
+    def test_changes_of_newer_transactions_wait_for_the_running_ones(self):
+        since = get_last_change_seq(db.session)
+        long_transaction = configure_pooled_session()
+        try:
+            self.write_readings(long_transaction, 'EQ-LONG', [1])
+            long_transaction.flush()
+
+            self.write_readings(db.session, 'EQ-SHORT', [2])
+            db.session.commit()
+
+            # committed, but a lower change_seq may still be committed before it
+            self.assertEqual(get_changes_since(db.session, since, 10), [])
+            db.session.commit()
+
+            long_transaction.commit()
+        finally:
+            long_transaction.close()
+
+        changes = get_changes_since(db.session, since, 10)
+        self.assertEqual([equipment_id for _, equipment_id, *_ in changes], ['EQ-LONG', 'EQ-SHORT'])
+
+    def test_new_consumers_start_before_the_running_transactions(self):
+        long_transaction = configure_pooled_session()
+        try:
+            self.write_readings(long_transaction, 'EQ-LONG', [1])
+            long_transaction.flush()
+
+            self.write_readings(db.session, 'EQ-SHORT', [2])
+            db.session.commit()
+
+            since = get_safe_change_seq(db.session)
+            self.assertLess(since, get_last_change_seq(db.session))
+            db.session.commit()
+
+            long_transaction.commit()
+        finally:
+            long_transaction.close()
+
+        changes = get_changes_since(db.session, since, 10)
+        self.assertEqual([equipment_id for _, equipment_id, *_ in changes], ['EQ-LONG', 'EQ-SHORT'])
+
+
+class TestUploadRoutes(DatabaseTestCase):
+
+    def test_upload_with_a_value_that_is_not_a_number_is_a_bad_request(self):
+        file = BytesIO(b'equipmentId;timestamp;value\n'
+                       b'EQ-1;2023-02-12T01:30:00.000-05:00;5\n'
+                       b'EQ-1;2023-02-12T01:31:00.000-05:00;abc\n')
+
+        response = self.client.post('/equipment/upload',
+                                    content_type='multipart/form-data',
+                                    headers=self.get_auth_headers(),
+                                    data={'file': (file, 'test.csv')})
+
+        self.assert400(response)
+        self.assertIn("o valor 'abc' não é numérico", response.json['message'])
+        self.assertEqual(db.session.query(Equipment).count(), 0)
+
+
+class TestUploadChunks(DatabaseTestCase):
+
+    def test_ids_are_read_as_text_in_every_chunk(self):
+        file = BytesIO(b'equipmentId;timestamp;value\n'
+                       b'007;2023-02-12T01:30:00.000-05:00;5\n'
+                       b'007;2023-02-12T01:31:00.000-05:00;6\n'
+                       b'007;2023-02-12T01:32:00.000-05:00;7\n'
+                       b'ABC;2023-02-12T01:33:00.000-05:00;8\n')
+
+        with patch.dict(os.environ, {'UPLOAD_CHUNK_ROWS': '2'}):
+            response = self.client.post('/equipment/upload',
+                                        content_type='multipart/form-data',
+                                        headers=self.get_auth_headers(),
+                                        data={'file': (file, 'test.csv')})
+
+        self.assert200(response)
+        self.assertEqual(sorted(device.equipmentId for device in db.session.query(EquipmentDevice)),
+                         ['007', 'ABC'])
+        self.assertEqual(db.session.query(Equipment).filter_by(equipmentId='007').count(), 3)
+
+
+class TestDeviceKeyRoutes(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        facet_cache.clear()
+
+    def test_listing_pages_are_ordered_by_equipment_id(self):
+        self.write_readings(db.session, 'EQ-B', [1.0, 2.0])
+        self.write_readings(db.session, 'EQ-A', [3.0, 4.0])
+        db.session.commit()
+
+        first_page = self.client.get('/equipment?per_page=3', headers=self.get_auth_headers())
+        second_page = self.client.get('/equipment?per_page=3&page=2', headers=self.get_auth_headers())
+
+        self.assert200(first_page)
+        self.assertEqual(first_page.json['total'], 4)
+        self.assertEqual([(row['equipmentId'], row['value']) for row in first_page.json['equipments']],
+                         [('EQ-A', 3.0), ('EQ-A', 4.0), ('EQ-B', 1.0)])
+        self.assertEqual([row['value'] for row in second_page.json['equipments']], [2.0])
+
+    def test_listing_filtered_by_equipment_id(self):
+        self.write_readings(db.session, 'EQ-B', [1.0, 2.0])
+        self.write_readings(db.session, 'EQ-A', [3.0])
+        db.session.commit()
+
+        response = self.client.get('/equipment?equipmentId=EQ-A', headers=self.get_auth_headers())
+
+        self.assert200(response)
+        self.assertEqual(response.json['total'], 1)
+        self.assertEqual(response.json['equipments'][0]['equipmentId'], 'EQ-A')
+
+    def test_post_writes_the_reading_against_one_device(self):
+        for value in (1.5, 2.5):
+            response = self.client.post('/equipment', json={'equipmentId': 'EQ-1', 'value': value},
+                                        headers=self.get_auth_headers())
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json['equipmentId'], 'EQ-1')
+
+        device = db.session.query(EquipmentDevice).filter_by(equipmentId='EQ-1').one()
+        readings = db.session.query(EquipmentReading).all()
+        self.assertTrue(readings)
+        self.assertEqual({reading.device_key for reading in readings}, {device.id})
+
+    def test_upload_writes_the_readings_against_their_devices(self):
+        file = BytesIO(b'equipmentId;timestamp;value\n'
+                       b'EQ-1;2023-02-12T01:30:00.000-05:00;5\n'
+                       b'EQ-2;2023-02-12T01:30:00.000-05:00;6\n'
+                       b'EQ-1;2023-02-12T01:31:00.000-05:00;7\n')
+
+        response = self.client.post('/equipment/upload',
+                                    content_type='multipart/form-data',
+                                    headers=self.get_auth_headers(),
+                                    data={'file': (file, 'test.csv')})
+
+        self.assert200(response)
+        devices = {device.equipmentId: device.id for device in db.session.query(EquipmentDevice)}
+        self.assertEqual(set(devices), {'EQ-1', 'EQ-2'})
+        self.assertEqual(
+            sorted((reading.device_key, reading.value) for reading in db.session.query(EquipmentReading)),
+            sorted([(devices['EQ-1'], 5.0), (devices['EQ-2'], 6.0), (devices['EQ-1'], 7.0)]))
+
+    def test_dropdowns_read_through_the_device_key(self):
+        self.write_readings(db.session, 'EQ-B', [1.0, 2.0])
+        self.write_readings(db.session, 'EQ-A', [2.0])
+        db.session.commit()
+
+        equipment_ids = self.client.get('/equipment?column_name=equipmentId&fields=value',
+                                        headers=self.get_auth_headers())
+        values = self.client.get('/equipment?column_name=value&counts=true',
+                                 headers=self.get_auth_headers())
+
+        self.assertEqual(equipment_ids.json['equipments'], [{'value': 'EQ-A'}, {'value': 'EQ-B'}])
+        self.assertEqual(values.json['equipments'], [{'count': 1, 'label': 1.0, 'value': 1.0},
+                                                     {'count': 2, 'label': 2.0, 'value': 2.0}])
+
+    def test_dropdowns_without_limit_list_every_value(self):
+        self.write_readings(db.session, 'EQ-1', [1.0, 2.0, 3.0])
+        db.session.commit()
+
+        with patch('src.routers.equipment.MAX_FACET_LIMIT', 2):
+            values = self.client.get('/equipment?column_name=value', headers=self.get_auth_headers())
+            limited = self.client.get('/equipment?column_name=value&limit=2', headers=self.get_auth_headers())
+            too_many = self.client.get('/equipment?column_name=value&limit=3', headers=self.get_auth_headers())
+
+        self.assertEqual([option['value'] for option in values.json['equipments']], [1.0, 2.0, 3.0])
+        self.assertEqual(values.json['total'], 3)
+        self.assertEqual([option['value'] for option in limited.json['equipments']], [1.0, 2.0])
+        self.assert400(too_many)
+
+
+class TestSharedFlight(DatabaseTestCase):
+
+    def get_advisory_lock_states(self) -> list[str]:
+        with get_pooled_engine().connect() as connection:
+            return connection.execute(text(
+                "SELECT a.state FROM pg_locks l JOIN pg_stat_activity a USING (pid) "
+                "WHERE l.locktype = 'advisory' AND l.granted")).scalars().all()
+
+    def test_lock_is_held_outside_a_transaction_and_released_with_the_result(self):
+        flight = SingleFlight('test', across_workers=True)
+        states = []
+
+        def compute():
+            states.extend(self.get_advisory_lock_states())
+            return ['shared']
+
+        self.assertEqual(flight.do('key', compute), ['shared'])
+        self.assertEqual(states, ['idle'])
+        self.assertEqual(self.get_advisory_lock_states(), [])
+        self.assertEqual(db.session.query(QueryResult.value).scalar(), ['shared'])
+
+
+class TestStorageMigration(DatabaseTestCase):
+
+    def test_old_readings_are_moved_to_device_keys_once(self):
+        db.session.execute(text('DROP TABLE equipment'))
+        db.session.execute(text("""
+            CREATE TABLE equipment (
+                id serial PRIMARY KEY,
+                "equipmentId" varchar(255) NOT NULL,
+                timestamp timestamp NOT NULL,
+                value double precision,
+                CONSTRAINT unique_equipment_timestamp UNIQUE ("equipmentId", timestamp)
+            )"""))
+        db.session.execute(text("""
+            INSERT INTO equipment ("equipmentId", timestamp, value) VALUES
+                ('EQ-1', '2024-07-26 00:00', 1.0),
+                ('EQ-2', '2024-07-26 00:00', 2.0),
+                ('EQ-1', '2024-07-26 00:01', 3.0)"""))
+
+        steps = migrate_storage(db.session)
+        db.session.commit()
+
+        self.assertEqual(steps, ['change feed columns', 'device keys', 'timestamp index'])
+        self.assertEqual(
+            sorted((row.equipmentId, row.value) for row in db.session.query(Equipment)),
+            [('EQ-1', 1.0), ('EQ-1', 3.0), ('EQ-2', 2.0)])
+        self.assertEqual(migrate_storage(db.session), [])
+
+        self.write_readings(db.session, 'EQ-1', [4.0], day=27)
+        db.session.commit()
+        self.assertEqual(db.session.query(Equipment).filter_by(equipmentId='EQ-1').count(), 3)
+
+    def test_current_database_is_left_alone(self):
+        self.assertEqual(migrate_storage(db.session), [])
+
+
+class TestOverloadedRoutes(DatabaseTestCase):
+
+    def test_pool_timeout_is_answered_with_503(self):
+        def wait_for_pool(*args):
+            raise PoolTimeoutError('QueuePool limit reached')
+
+        with patch.object(equipment_module, 'get_listing_page', wait_for_pool):
+            response = self.client.get('/equipment', headers=self.get_auth_headers())
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '5')
+
+    def test_query_cancelled_at_the_deadline_is_answered_with_503(self):
+        def slow_listing(*args):
+            db.session.execute(text('SELECT pg_sleep(3)'))
+
+        with patch.dict(os.environ, {'ADMISSION_DEFAULT_DEADLINE_SECONDS': '1'}), \
+                patch.object(equipment_module, 'get_listing_page', slow_listing):
+            response = self.client.get('/equipment', headers=self.get_auth_headers())
+
+        self.assertEqual(response.status_code, 503)
+
+    def test_upload_waiting_for_the_pool_is_answered_with_503(self):
+        def wait_for_pool(*args):
+            raise PoolTimeoutError('QueuePool limit reached')
+
+        with patch.object(equipment_module, 'ingest_partitions', wait_for_pool):
+            response = self.client.post('/equipment/upload',
+                                        content_type='multipart/form-data',
+                                        headers=self.get_auth_headers(),
+                                        data={'file': (BytesIO(b'equipmentId;timestamp;value\n'
+                                                               b'EQ-1;2023-02-12T01:30:00;5\n'), 'test.csv')})
+
+        self.assertEqual(response.status_code, 503)
+
+
+class TestRequestDeadline(DatabaseTestCase):
+
+    def test_every_transaction_of_a_request_gets_the_deadline(self):
+        with self.app.test_request_context('/equipment'), db.engine.connect() as connection:
+            g.deadline = monotonic() + 5
+            session = Session(bind=connection)
+
+            for _ in range(2):
+                assert session.execute(text('SHOW statement_timeout')).scalar() != '0'
+                session.commit()
+
+
 class TestEquipmentRoutes(TestCase):
     def create_app(self):
         app = create_app('testing')
@@ -9,16 +9,19 @@ from flask import request, make_response, jsonify
 from flask_restx import Resource
 from flask_smorest import Blueprint
 from pytz import timezone
+from sqlalchemy import bindparam, select
 
 from src.helpers import LogHelper
 from src.logs import logger
 from src.models import User, UserSchema
-from src.routers.helpers import get_response, configure_session
+from src.routers.helpers import get_response, configure_pooled_session
 
 load_dotenv()
 
 login_blueprint = Blueprint("Login", __name__)
 
+ACTIVE_USER_STATEMENT = select(User).where(User.email == bindparam('email'), User.activated)
+
 
 @login_blueprint.route('/login')
 class Login(Resource):
@@ -34,12 +37,9 @@ class Login(Resource):
         if not (password):
             return get_response(HTTPStatus.BAD_REQUEST, "The password field must be sent")
 
-        with closing(configure_session()) as session:
+        with closing(configure_pooled_session()) as session:
 
-            user: User = session.query(User) \
-                .filter(User.email == email) \
-                .filter(User.activated) \
-                .first()
+            user: User = session.scalars(ACTIVE_USER_STATEMENT, {'email': email}).first()
 
             if not user or not User.verify_password(user, pwd=password):
                 return get_response(HTTPStatus.FORBIDDEN, "Email or password is incorrect")
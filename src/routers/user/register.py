@@ -8,7 +8,7 @@ from src.config import db
 from src.logs import logger
 from src.models import User, UserSchema
 
-from src.routers.helpers import get_response
+from src.routers.helpers import get_response, mark_primary_write
 
 
 register_blueprint = Blueprint("Register", __name__)
@@ -46,5 +46,6 @@ class RouteRegister(Resource):
 
         db.session.add(user)
         db.session.commit()
+        mark_primary_write()
         logger.info(f'User created: {body}')
         return UserSchema().dump(user), HTTPStatus.CREATED